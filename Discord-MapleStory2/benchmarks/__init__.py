@@ -0,0 +1,37 @@
+"""Checks and timings for the helpers in cogs/utils
+
+They are kept out of the cogs so the bot never imports them. Run one
+from the bot's folder, e.g.:
+
+    python -m benchmarks.forum bench
+"""
+import os
+import sys
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+
+
+def best_time(func, runs):
+    """Fastest of runs calls of func, in seconds"""
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def timed(func, *args):
+    """Returns func's result and how long it took, in seconds"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def fail(message):
+    """Reports a mismatch and exits with an error status"""
+    print(message)
+    sys.exit(1)
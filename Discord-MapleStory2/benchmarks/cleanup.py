@@ -0,0 +1,139 @@
+"""Streamed cleanup latency
+
+Cleans up a fake channel history with simulated request latency, once
+collecting every match before deleting as the cleanup commands used to,
+once through stream_deletions, and compares the time to the first
+deletion and the total:
+
+    python -m benchmarks.cleanup [--messages 10000] [--page-latency 50]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from cogs.utils.cleanup import stream_deletions
+from . import fail
+
+
+class _FakeMessage:
+    __slots__ = ("id", "matches", "old")
+
+    def __init__(self, id, matches, old):
+        self.id = id
+        self.matches = matches
+        self.old = old
+
+
+class _FakeHistory:
+    """Pages through messages 100 at a time like logs_from, each page
+    costing one request"""
+    def __init__(self, messages, latency, loop):
+        self.messages = messages
+        self.latency = latency
+        self.loop = loop
+        self.position = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.position >= len(self.messages):
+            raise StopAsyncIteration
+        if self.position % 100 == 0:
+            await asyncio.sleep(self.latency, loop=self.loop)
+        message = self.messages[self.position]
+        self.position += 1
+        return message
+
+
+class _FakeChannel:
+    def __init__(self, args, loop):
+        self.args = args
+        self.loop = loop
+        self.deleted = set()
+        self.first = None
+
+    def _record(self, messages):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.deleted.update(m.id for m in messages)
+
+    async def purge(self, messages):
+        await asyncio.sleep(self.args.purge_latency / 1000, loop=self.loop)
+        self._record(messages)
+
+    async def delete(self, message):
+        await asyncio.sleep(self.args.delete_latency / 1000, loop=self.loop)
+        self._record([message])
+
+
+async def _collect_then_delete(history, check, number, channel):
+    to_delete = []
+    async for message in history:
+        if len(to_delete) < number and check(message):
+            to_delete.append(message)
+    young = [m for m in to_delete if not m.old]
+    for i in range(0, len(young), 100):
+        await channel.purge(young[i:i + 100])
+    for message in to_delete:
+        if message.old:
+            await channel.delete(message)
+    return len(to_delete)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares collecting then "
+                                     "deleting with a streamed cleanup")
+    parser.add_argument("--messages", type=int, default=10000,
+                        help="messages in the fake history")
+    parser.add_argument("--match", type=float, default=0.5,
+                        help="share of messages the cleanup matches")
+    parser.add_argument("--old", type=float, default=0.05,
+                        help="share of messages too old to bulk delete")
+    parser.add_argument("--page-latency", type=float, default=50,
+                        help="ms per 100 messages of history")
+    parser.add_argument("--purge-latency", type=float, default=50,
+                        help="ms per bulk delete")
+    parser.add_argument("--delete-latency", type=float, default=10,
+                        help="ms per single delete")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = [_FakeMessage(i, rng.random() < args.match,
+                             rng.random() < args.old)
+                for i in range(args.messages)]
+    expected = {m.id for m in messages if m.matches}
+    check = lambda m: m.matches
+    loop = asyncio.get_event_loop()
+    results = []
+
+    for name in ("Collect then delete", "Streamed"):
+        channel = _FakeChannel(args, loop)
+        history = _FakeHistory(messages, args.page_latency / 1000, loop)
+        start = time.perf_counter()
+        if name == "Streamed":
+            coro = stream_deletions(history, check, len(messages),
+                                    purge=channel.purge,
+                                    delete=channel.delete, loop=loop,
+                                    bulk_deletable=lambda m: not m.old)
+        else:
+            coro = _collect_then_delete(history, check, len(messages),
+                                        channel)
+        loop.run_until_complete(coro)
+        total = time.perf_counter() - start
+        if channel.deleted != expected:
+            fail("{}: deleted {} messages, expected {}".format(
+                name, len(channel.deleted), len(expected)))
+        results.append((name, channel.first - start, total))
+
+    print("Both deleted the {} matching messages of {}".format(
+        len(expected), len(messages)))
+    for name, first, total in results:
+        print("{:<20} first deletion after {:>6.2f}s, done in {:>6.2f}s"
+              "".format(name, first, total))
+
+
+if __name__ == "__main__":
+    main()
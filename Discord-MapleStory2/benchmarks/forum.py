@@ -0,0 +1,228 @@
+"""Forum listing parser and revalidation
+
+bench compares the streaming parser with the BeautifulSoup extraction
+it replaced on a saved listing page and times both. check runs the
+ListingLoader against a local stub forum to make sure unchanged pages
+are neither downloaded nor parsed again.
+
+    python -m benchmarks.forum bench [--page PAGE] [--runs RUNS]
+    python -m benchmarks.forum check [--page PAGE]
+"""
+import argparse
+import asyncio
+import hashlib
+import http.server
+import os
+import socketserver
+import sys
+import threading
+
+import aiohttp
+import dateutil.parser
+
+from cogs.utils.forum import ListingLoader, get_listing_table, parse_listing
+from . import FIXTURES, best_time, fail
+
+FIXTURE_PATH = os.path.join(FIXTURES, 'forum_listing.html')
+
+
+def _bs4_listing(page):
+    #   the extraction the news cog did with BeautifulSoup, plus the
+    #   date every caller parsed afterwards
+    from bs4 import BeautifulSoup
+    items = []
+    soup = BeautifulSoup(page, 'html.parser')
+    for row in soup.select('tr'):
+        discussion_id = row.get('id')
+        title = row.find('a', attrs={'class': 'Title'})
+        date_created = row.find('time')
+        if discussion_id is None:
+            continue
+        date = dateutil.parser.parse(date_created['datetime'])
+        items.append({
+            'id': discussion_id,
+            'title': title.text,
+            'link': title.get('href') + '/p1',
+            'date_created': date_created['datetime'],
+            'date': date
+        })
+    return items
+
+
+def bench(args):
+    with open(args.page, encoding='utf-8') as f:
+        page = f.read()
+    items = parse_listing(get_listing_table(page))
+    print("{}: {} rows, {} bytes".format(args.page, len(items), len(page)))
+
+    try:
+        import bs4
+    except ImportError:
+        print("bs4 isn't installed, only timing the streaming parser")
+        expected = None
+    else:
+        expected = _bs4_listing(page)
+        if items != expected:
+            print("Rows differ from BeautifulSoup:")
+            for got, want in zip(items, expected):
+                if got != want:
+                    print("  got  {}\n  want {}".format(got, want))
+            fail("  {} rows instead of {}".format(len(items),
+                                                 len(expected)))
+        print("Same rows as BeautifulSoup")
+
+    timings = [
+        ("streaming parser",
+         lambda: parse_listing(get_listing_table(page))),
+    ]
+    if expected is not None:
+        timings.append(("BeautifulSoup", lambda: _bs4_listing(page)))
+    for name, func in timings:
+        print("{:<20}{:>8.2f} ms".format(
+            name, best_time(func, args.runs) * 1000))
+
+
+class _StubForum(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    #   /etag answers conditional requests, /plain always sends the page
+    daemon_threads = True
+
+    def __init__(self, page):
+        super().__init__(('127.0.0.1', 0), _StubForumHandler)
+        self.page = page
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class _StubForumHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        page = self.server.page
+        etag = '"{}"'.format(hashlib.sha1(page).hexdigest())
+        conditional = self.path == '/etag'
+        if conditional and self.headers.get('If-None-Match') == etag:
+            self.server.requests.append((self.path, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.requests.append((self.path, 200))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        if conditional:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _new_ids(news, mark):
+    #   what the poller delivers for a LAST_DATE mark, oldest first
+    return [item['id'] for item in sorted(news, key=lambda item: item['date'])
+            if item['date'] > mark]
+
+
+async def _check_loader(server, loop):
+    session = aiohttp.ClientSession(loop=loop)
+    loader = ListingLoader(session, loop)
+    failures = []
+
+    def expect(condition, message):
+        print("{} {}".format("ok  " if condition else "FAIL", message))
+        if not condition:
+            failures.append(message)
+
+    try:
+        #   the forum sorts rows by last activity, so a mark can sit
+        #   above rows that still have to be delivered
+        full = parse_listing(get_listing_table(server.page))
+        missed = []
+        for mark in sorted(set(item['date'] for item in full)):
+            marked = ListingLoader(session, loop)
+            news = await marked.load(server.url + '/plain')
+            if news is None or _new_ids(news, mark) != _new_ids(full, mark):
+                missed.append(mark.isoformat())
+        expect(not missed, "every item newer than each of the {} marks is "
+               "loaded{}".format(len(set(item['date'] for item in full)),
+                                 ", not for " + ", ".join(missed)
+                                 if missed else ""))
+
+        for path in ('/etag', '/plain'):
+            url = server.url + path
+            del server.requests[:]
+            parses = loader.parses
+            first = await loader.load(url)
+            second = await loader.load(url)
+            expect(first is not None and len(first) > 0,
+                   "{} is parsed on the first load".format(path))
+            expect(second is first and loader.parses == parses + 1,
+                   "{} isn't parsed again while unchanged".format(path))
+            if path == '/etag':
+                expect(server.requests == [(path, 200), (path, 304)],
+                       "{} is revalidated with a 304".format(path))
+            else:
+                expect(server.requests == [(path, 200), (path, 200)],
+                       "{} is downloaded again and skipped by its hash"
+                       "".format(path))
+
+        page = server.page
+        server.page = page.replace(b'</tbody>', b'<tr id="Discussion_1">'
+                                   b'<td><a class="Title" href="/d/1">New'
+                                   b'</a><time datetime="2018-06-02T00:00:00'
+                                   b'+00:00"></time></td></tr></tbody>')
+        for path in ('/etag', '/plain'):
+            url = server.url + path
+            previous = loader.listings[url][1]
+            changed = await loader.load(url)
+            expect(changed is not previous and
+                   len(changed) == len(previous) + 1,
+                   "{} is parsed again once it changes".format(path))
+        server.page = page
+    finally:
+        closed = session.close()
+        if asyncio.iscoroutine(closed):
+            await closed
+    return failures
+
+
+def check(args):
+    with open(args.page, 'rb') as f:
+        server = _StubForum(f.read())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    loop = asyncio.get_event_loop()
+    try:
+        failures = loop.run_until_complete(_check_loader(server, loop))
+    finally:
+        server.shutdown()
+        server.server_close()
+    if failures:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks and times the "
+                                     "forum listing parser")
+    commands = parser.add_subparsers(dest="command")
+    bench_parser = commands.add_parser("bench", help="compare the parser "
+                                       "with BeautifulSoup on a saved page")
+    bench_parser.add_argument("--page", default=FIXTURE_PATH)
+    bench_parser.add_argument("--runs", type=int, default=50)
+    bench_parser.set_defaults(func=bench)
+    check_parser = commands.add_parser("check", help="check revalidation "
+                                       "against a local stub forum")
+    check_parser.add_argument("--page", default=FIXTURE_PATH)
+    check_parser.set_defaults(func=check)
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(2)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Ignore list membership
+
+Saves and reloads random id lists through load_id_sets/save_id_sets,
+then replays user_allowed's id checks against lists and sets of the
+same ids. Each size given to --ids is timed, so the cost of a list can
+be seen growing with it while the set's stays flat:
+
+    python -m benchmarks.idsets [--ids 10000 100000] [--messages 2000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from cogs.utils.dataIO import dataIO
+from cogs.utils.idsets import load_id_sets, save_id_sets
+from . import fail
+
+
+def _allowed(message, global_ignores, ignore_list):
+    # The id checks of Bot.user_allowed, in the same order
+    author, server, channel = message
+    if author in global_ignores["blacklist"]:
+        return False
+    if global_ignores["whitelist"]:
+        if author not in global_ignores["whitelist"]:
+            return False
+    if server in ignore_list["SERVERS"]:
+        return False
+    if channel in ignore_list["CHANNELS"]:
+        return False
+    return True
+
+
+def _random_id(rng):
+    return str(rng.randrange(10 ** 17, 10 ** 18))
+
+
+def _replay(rng, size, messages):
+    lists = {
+        "global_ignores": {
+            "blacklist": [_random_id(rng) for i in range(size)],
+            "whitelist": [_random_id(rng) for i in range(size)]},
+        "ignore_list": {
+            "SERVERS": [_random_id(rng) for i in range(size)],
+            "CHANNELS": [_random_id(rng) for i in range(size)]}
+    }
+
+    # Saved and loaded back the way the cogs do it
+    sets = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name, id_lists in lists.items():
+            filename = os.path.join(folder, name + ".json")
+            save_id_sets(filename, id_lists)
+            sets[name] = load_id_sets(filename)
+            if dataIO.load_json(filename) != {k: sorted(v) for k, v
+                                              in id_lists.items()}:
+                fail("{} was not saved as sorted lists".format(name))
+
+    # Mostly unknown ids, with some listed ones so every branch is taken
+    def pick(ids):
+        return rng.choice(ids) if rng.random() < 0.2 else _random_id(rng)
+    messages = [(pick(lists["global_ignores"]["whitelist"]),
+                 pick(lists["ignore_list"]["SERVERS"]),
+                 pick(lists["ignore_list"]["CHANNELS"]))
+                for i in range(messages)]
+
+    timings = []
+    verdicts = []
+    for data in (lists, sets):
+        start = time.perf_counter()
+        verdicts.append([_allowed(m, data["global_ignores"],
+                                  data["ignore_list"]) for m in messages])
+        timings.append((time.perf_counter() - start) / len(messages))
+
+    if verdicts[0] != verdicts[1]:
+        fail("With {} ids, lists and sets disagree on {} of {} messages"
+             "".format(size, sum(a != b for a, b in zip(*verdicts)),
+                       len(messages)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times user_allowed's id "
+                                     "checks against lists and sets")
+    parser.add_argument("--ids", type=int, nargs="+",
+                        default=[10000, 100000],
+                        help="ids in each list, one run per size")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [(size, _replay(rng, size, args.messages))
+               for size in args.ids]
+    print("Same verdict for lists and sets on {} messages at every size"
+          "".format(args.messages))
+    print("{:>10}{:>14}{:>14}".format("Ids", "List (us)", "Set (us)"))
+    for size, (list_time, set_time) in results:
+        print("{:>10}{:>14.2f}{:>14.2f}".format(size, list_time * 1e6,
+                                                set_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
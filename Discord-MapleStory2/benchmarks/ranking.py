@@ -0,0 +1,114 @@
+"""Leaderboard index against sorting
+
+Builds a BalanceIndex over a fake bank and compares its leaderboards and
+ranks with sorting every account on each request, the way the
+leaderboard commands used to:
+
+    python -m benchmarks.ranking [--accounts 1000000] [--servers 100]
+"""
+from collections import defaultdict
+from itertools import islice
+import argparse
+import random
+import time
+
+from cogs.utils.ranking import BalanceIndex
+from . import fail, timed
+
+
+def _fake_bank(rng, accounts, servers):
+    server_ids = [str(rng.randrange(10 ** 17, 10 ** 18))
+                  for i in range(servers)]
+    bank = {server_id: {} for server_id in server_ids}
+    for i in range(accounts):
+        user_id = str(rng.randrange(10 ** 17, 10 ** 18))
+        # Mostly small balances with a long tail, plenty of ties
+        balance = int(rng.paretovariate(1.5) * 100)
+        bank[rng.choice(server_ids)][user_id] = {"balance": balance}
+    return bank
+
+
+def _sorted_top(bank, server_id, top):
+    if server_id is None:
+        accounts = ((a["balance"], user_id, s)
+                    for s, server_accounts in bank.items()
+                    for user_id, a in server_accounts.items())
+    else:
+        accounts = ((a["balance"], user_id, server_id)
+                    for user_id, a in bank[server_id].items())
+    return sorted(accounts, key=lambda a: (-a[0], a[1]))[:top]
+
+
+def _index_rank(index, server_id, user_id, balance):
+    return sum(1 for i in index.ahead(server_id, user_id, balance)) + 1
+
+
+def _sorted_rank(bank, server_id, user_id):
+    ranked = sorted(bank[server_id].items(),
+                    key=lambda a: (-a[1]["balance"], a[0]))
+    return [u for u, a in ranked].index(user_id) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the balance "
+                                     "index with sorting every account")
+    parser.add_argument("--accounts", type=int, default=1000000)
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=5,
+                        help="leaderboards and ranks asked for")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bank = _fake_bank(rng, args.accounts, args.servers)
+    index, build_time = timed(BalanceIndex, bank)
+    print("Indexed {} accounts on {} servers in {:.2f}s".format(
+        args.accounts, args.servers, build_time))
+
+    times = defaultdict(float)
+    for i in range(args.queries):
+        server_id = rng.choice(list(bank))
+        user_id = rng.choice(list(bank[server_id]))
+        balance = bank[server_id][user_id]["balance"]
+        for scope in (None, server_id):
+            name = "global top" if scope is None else "server top"
+            expected, elapsed = timed(_sorted_top, bank, scope, args.top)
+            times[name, "sort"] += elapsed
+            got, elapsed = timed(lambda: list(islice(index.top(scope),
+                                                      args.top)))
+            times[name, "index"] += elapsed
+            if got != expected:
+                fail("The index disagrees on the {}".format(name))
+
+        expected, elapsed = timed(_sorted_rank, bank, server_id, user_id)
+        times["rank", "sort"] += elapsed
+        got, elapsed = timed(_index_rank, index, server_id, user_id,
+                             balance)
+        times["rank", "index"] += elapsed
+        if got != expected:
+            fail("The index ranks a user {}, sorting ranks them {}"
+                 "".format(got, expected))
+
+        # A payday: the sort has nothing to maintain, the index moves
+        # the account to its new place
+        new_balance = balance + 120
+        start = time.perf_counter()
+        index.remove(server_id, user_id, balance)
+        index.add(server_id, user_id, new_balance)
+        times["update", "index"] += time.perf_counter() - start
+        bank[server_id][user_id]["balance"] = new_balance
+
+    print("Same results over {} queries, average ms per request:".format(
+        args.queries))
+    print("{:<12}{:>12}{:>12}".format("", "Sort", "Index"))
+    for name in ("global top", "server top", "rank", "update"):
+        sort = times.get((name, "sort"))
+        print("{:<12}{:>12}{:>12.3f}".format(
+            name, "-" if sort is None else
+            "{:.3f}".format(sort / args.queries * 1000),
+            times[name, "index"] / args.queries * 1000))
+
+
+if __name__ == "__main__":
+    main()
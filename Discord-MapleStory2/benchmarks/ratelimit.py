@@ -0,0 +1,104 @@
+"""Server mute overwrite edits
+
+Edits overwrites on a fake server of slow channels that sometimes answer
+with a 429, one channel at a time and through gather_with_backoff, and
+compares both:
+
+    python -m benchmarks.ratelimit [--channels 500] [--limit 5]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import discord
+
+from cogs.utils.ratelimit import gather_with_backoff
+from . import fail
+
+
+class _FakeResponse:
+    def __init__(self, status, reason, retry_after=None):
+        self.status = status
+        self.reason = reason
+        self.headers = {}
+        if retry_after is not None:
+            self.headers["Retry-After"] = str(retry_after)
+
+
+class _FakeServer:
+    """Channels whose overwrite edits take `latency` seconds, are rate
+    limited at random and are forbidden in a fixed few"""
+    def __init__(self, args, loop):
+        self.args = args
+        self.loop = loop
+        rng = random.Random(args.seed)
+        self.forbidden = {i for i in range(args.channels)
+                          if rng.random() < args.forbidden}
+        self.rng = random.Random(args.seed + 1)
+        self.edited = set()
+        self.rate_limited = 0
+
+    async def edit(self, channel):
+        await asyncio.sleep(self.args.latency / 1000, loop=self.loop)
+        if self.rng.random() < self.args.rate_limited:
+            self.rate_limited += 1
+            raise discord.HTTPException(
+                _FakeResponse(429, "Too Many Requests",
+                              self.args.retry_after),
+                "You are being rate limited.")
+        if channel in self.forbidden:
+            raise discord.Forbidden(_FakeResponse(403, "Forbidden"),
+                                    "Missing Permissions")
+        self.edited.add(channel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares sequential "
+                                     "overwrite edits with "
+                                     "gather_with_backoff")
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=5,
+                        help="edits in flight at once")
+    parser.add_argument("--latency", type=float, default=20,
+                        help="ms per edit")
+    parser.add_argument("--rate-limited", type=float, default=0.05,
+                        help="share of edits answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=100,
+                        help="ms a 429 asks to wait")
+    parser.add_argument("--forbidden", type=float, default=0.01,
+                        help="share of channels the bot can't edit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    results = []
+    for name, limit in (("One at a time", 1),
+                        ("gather_with_backoff", args.limit)):
+        server = _FakeServer(args, loop)
+        factories = [lambda c=c: server.edit(c) for c in range(args.channels)]
+        start = time.perf_counter()
+        outcome = loop.run_until_complete(
+            gather_with_backoff(factories, limit=limit, loop=loop))
+        elapsed = time.perf_counter() - start
+
+        forbidden = {c for c, r in enumerate(outcome)
+                     if isinstance(r, discord.Forbidden)}
+        gave_up = {c for c, r in enumerate(outcome)
+                   if isinstance(r, discord.HTTPException) and
+                   r.response.status == 429}
+        # Every other edit must have gone through, in the right slot
+        if (forbidden != server.forbidden - gave_up or server.edited !=
+                set(range(args.channels)) - forbidden - gave_up):
+            fail("{}: results don't match the edits made".format(name))
+        results.append((name, elapsed, server.rate_limited, len(gave_up)))
+
+    print("Edited {} channels, {} of them forbidden".format(
+        args.channels, len(server.forbidden)))
+    for name, elapsed, rate_limited, gave_up in results:
+        print("{:<20} {:>6.2f}s, {:>4} times rate limited, gave up on {}"
+              "".format(name, elapsed, rate_limited, gave_up))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Repeat tracker memory and speed
+
+Replays a random message stream through RepeatTracker and through the
+author id to message deque cache it replaced, checks they flag the same
+messages, and compares the memory they hold and their speed:
+
+    python -m benchmarks.repeats [--users 150000] [--messages 600000]
+"""
+from collections import OrderedDict, deque
+import argparse
+import random
+import time
+import tracemalloc
+
+from cogs.utils.repeats import RepeatTracker
+from . import fail
+
+
+class _DequeTracker:
+    """The author id to last three messages cache the tracker replaced"""
+    def __init__(self, max_records=100000):
+        self.max_records = max_records
+        self.cache = OrderedDict()
+
+    def add(self, author_id, content):
+        if author_id not in self.cache:
+            self.cache[author_id] = deque(maxlen=3)
+        self.cache.move_to_end(author_id)
+        while len(self.cache) > self.max_records:
+            self.cache.popitem(last=False)
+        self.cache[author_id].append(content)
+        msgs = self.cache[author_id]
+        return len(msgs) == 3 and msgs[0] == msgs[1] == msgs[2]
+
+
+def _random_stream(rng, users, messages, length):
+    authors = [str(rng.getrandbits(63)) for i in range(users)]
+    last = {}
+    stream = []
+    # Every author speaks once, then repeats their last line a third
+    # of the time so runs of three show up regularly
+    for i in range(messages):
+        author = authors[i] if i < users else rng.choice(authors)
+        if author in last and rng.random() < 0.33:
+            content = last[author]
+        else:
+            size = rng.randint(1, length)
+            content = "{:0{}x}".format(rng.getrandbits(4 * size), size)
+        last[author] = content
+        stream.append((author, content))
+    return stream
+
+
+def _replay(make_add, stream):
+    add = make_add()
+    flagged = bytearray(len(stream))
+    start = time.perf_counter()
+    for i, (author, content) in enumerate(stream):
+        flagged[i] = add(author, content)
+    elapsed = time.perf_counter() - start
+
+    # A second, traced run, since tracing slows everything down. The
+    # stream was allocated beforehand so only what the tracker holds on
+    # to is counted
+    add = make_add()
+    tracemalloc.start()
+    for author, content in stream:
+        add(author, content)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return flagged, elapsed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the repeat "
+                                     "tracker with the old message cache")
+    parser.add_argument("--users", type=int, default=150000)
+    parser.add_argument("--messages", type=int, default=600000)
+    parser.add_argument("--length", type=int, default=200,
+                        help="longest random message")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stream = _random_stream(rng, args.users, args.messages, args.length)
+
+    old_flagged, old_time, old_memory = _replay(
+        lambda: _DequeTracker().add, stream)
+
+    # The whole replay is well within the expiry window, as it is for
+    # the old cache which had none
+    def make_add():
+        tracker = RepeatTracker()
+        return lambda author, content: tracker.add("1", author, content,
+                                                   now=0) >= 3
+    new_flagged, new_time, new_memory = _replay(make_add, stream)
+    tracked = min(len(set(author for author, content in stream)),
+                  RepeatTracker().max_records)
+
+    if old_flagged != new_flagged:
+        fail("The tracker disagrees with the old cache on {} of {} "
+             "messages".format(sum(a != b for a, b in
+                                   zip(old_flagged, new_flagged)),
+                               len(stream)))
+    print("Same verdict as the old cache on {} messages, {} flagged, "
+          "{} authors tracked".format(len(stream), sum(new_flagged),
+                                      tracked))
+    for name, elapsed, memory in (("Message deques", old_time, old_memory),
+                                  ("Repeat tracker", new_time, new_memory)):
+        print("{}: {:>8.2f} us per message, {:>6.1f} MiB held, "
+              "{:>5.0f} bytes per author".format(
+                  name, elapsed / len(stream) * 1e6, memory / 2 ** 20,
+                  memory / tracked))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Slot machine simulator
+
+Times the vectorized simulator and prints the payout statistics of some
+bids. With --reference it also plays spins one by one, the way the cog
+does, to compare speed and results:
+
+    python -m benchmarks.slots --spins 1000000 5 100
+"""
+import argparse
+import time
+
+from cogs.utils.slots import find_payout, simulate, spin_reels
+
+
+def _reference(bid, spins):
+    paid = hits = 0
+    for i in range(spins):
+        payout = find_payout(spin_reels()[1])
+        if payout:
+            paid += payout["payout"](bid)
+            hits += 1
+    return paid / (bid * spins), hits / spins
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates the slot "
+                                     "machine and times the simulator")
+    parser.add_argument("bids", type=int, nargs="*", default=[5, 100])
+    parser.add_argument("--spins", type=int, default=1000000)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--reference", type=int, default=0, metavar="SPINS",
+                        help="also play SPINS spins one by one, the way "
+                        "the cog does, to compare speed and results")
+    args = parser.parse_args()
+    for bid in args.bids:
+        start = time.perf_counter()
+        stats = simulate(bid, args.spins, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        print("Bid {}: {} spins in {:.2f}s ({:.0f} spins/s)"
+              "".format(bid, stats.spins, elapsed, stats.spins / elapsed))
+        print("  RTP {:.2%}, hit frequency {:.2%}, variance {:.1f}"
+              "".format(stats.rtp, stats.hit_frequency, stats.variance))
+        if args.reference:
+            start = time.perf_counter()
+            rtp, hit_frequency = _reference(bid, args.reference)
+            elapsed = time.perf_counter() - start
+            print("  Reference: {} spins in {:.2f}s ({:.0f} spins/s), "
+                  "RTP {:.2%}, hit frequency {:.2%}"
+                  "".format(args.reference, elapsed,
+                            args.reference / elapsed, rtp, hit_frequency))
+
+
+if __name__ == "__main__":
+    main()
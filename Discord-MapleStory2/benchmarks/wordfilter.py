@@ -0,0 +1,67 @@
+"""Word filter pattern
+
+Checks the compiled trie pattern against a plain loop over the filtered
+words on random messages, and times both:
+
+    python -m benchmarks.wordfilter [--words 10000] [--messages 2000]
+"""
+import argparse
+import random
+import string
+import time
+
+from cogs.utils.wordfilter import build_filter_pattern
+from . import fail
+
+
+def _random_word(rng, low, high):
+    return "".join(rng.choice(string.ascii_lowercase)
+                   for i in range(rng.randint(low, high)))
+
+
+def _random_message(rng, words):
+    tokens = [_random_word(rng, 2, 8) for i in range(rng.randint(3, 30))]
+    if rng.random() < 0.1:
+        tokens.insert(rng.randrange(len(tokens) + 1), rng.choice(words))
+    return " ".join(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks and times the "
+                                     "compiled word filter")
+    parser.add_argument("--words", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = list({_random_word(rng, 5, 12) for i in range(args.words)})
+    messages = [_random_message(rng, words) for i in range(args.messages)]
+
+    start = time.perf_counter()
+    pattern = build_filter_pattern(words)
+    print("Compiled {} words in {:.2f}s".format(len(words),
+                                               time.perf_counter() - start))
+
+    start = time.perf_counter()
+    expected = [any(w in m.lower() for w in words) for m in messages]
+    loop_time = (time.perf_counter() - start) / len(messages)
+
+    start = time.perf_counter()
+    got = [pattern.search(m.lower()) is not None for m in messages]
+    pattern_time = (time.perf_counter() - start) / len(messages)
+
+    if got != expected:
+        fail("The pattern disagrees with the loop on {} of {} messages"
+             "".format(sum(a != b for a, b in zip(got, expected)),
+                       len(messages)))
+    print("Same verdict as the loop on {} messages, {} filtered"
+          "".format(len(messages), sum(got)))
+    print("Loop over the words: {:>10.1f} us per message".format(
+        loop_time * 1e6))
+    print("Compiled pattern:    {:>10.1f} us per message".format(
+        pattern_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,34 @@
 import discord
 from discord.ext import commands
-from cogs.utils.dataIO import dataIO
-from collections import namedtuple, defaultdict, deque
+from cogs.utils.dataIO import dataIO, JsonJournal
+from collections import namedtuple, defaultdict
 from datetime import datetime
 from copy import deepcopy
+from itertools import islice
+from contextlib import contextmanager
+from functools import partial
 from .utils import checks
+from .utils.slots import SMReel, spin_reels, find_payout, simulate
+from .utils.ranking import BalanceIndex
 from cogs.utils.chat_formatting import pagify, box
-from enum import Enum
 from __main__ import send_cmd_help
 import os
 import time
 import logging
-import random
+import sqlite3
+import asyncio
+import weakref
 
 default_settings = {"PAYDAY_TIME": 300, "PAYDAY_CREDITS": 120,
                     "SLOT_MIN": 5, "SLOT_MAX": 100, "SLOT_TIME": 0,
                     "REGISTER_CREDITS": 0}
+MAX_SIMULATED_SPINS = 10000000
+
+bank_settings_path = "data/economy/bank_settings.json"
+default_bank_settings = {"BACKEND": "json"}
+# Backend name -> where its accounts are stored
+bank_paths = {"json": "data/economy/bank.json",
+              "sqlite": "data/economy/bank.db"}
 
 
 class EconomyError(Exception):
@@ -54,51 +67,7 @@ class SameSenderAndReceiver(BankError):
     pass
 
 
-NUM_ENC = "\N{COMBINING ENCLOSING KEYCAP}"
-
-
-class SMReel(Enum):
-    cherries  = "\N{CHERRIES}"
-    cookie    = "\N{COOKIE}"
-    two       = "\N{DIGIT TWO}" + NUM_ENC
-    flc       = "\N{FOUR LEAF CLOVER}"
-    cyclone   = "\N{CYCLONE}"
-    sunflower = "\N{SUNFLOWER}"
-    six       = "\N{DIGIT SIX}" + NUM_ENC
-    mushroom  = "\N{MUSHROOM}"
-    heart     = "\N{HEAVY BLACK HEART}"
-    snowflake = "\N{SNOWFLAKE}"
-
-PAYOUTS = {
-    (SMReel.two, SMReel.two, SMReel.six) : {
-        "payout" : lambda x: x * 2500 + x,
-        "phrase" : "JACKPOT! 226! Your bid has been multiplied * 2500!"
-    },
-    (SMReel.flc, SMReel.flc, SMReel.flc) : {
-        "payout" : lambda x: x + 1000,
-        "phrase" : "4LC! +1000!"
-    },
-    (SMReel.cherries, SMReel.cherries, SMReel.cherries) : {
-        "payout" : lambda x: x + 800,
-        "phrase" : "Three cherries! +800!"
-    },
-    (SMReel.two, SMReel.six) : {
-        "payout" : lambda x: x * 4 + x,
-        "phrase" : "2 6! Your bid has been multiplied * 4!"
-    },
-    (SMReel.cherries, SMReel.cherries) : {
-        "payout" : lambda x: x * 3 + x,
-        "phrase" : "Two cherries! Your bid has been multiplied * 3!"
-    },
-    "3 symbols" : {
-        "payout" : lambda x: x + 500,
-        "phrase" : "Three symbols! +500!"
-    },
-    "2 symbols" : {
-        "payout" : lambda x: x * 2 + x,
-        "phrase" : "Two consecutive symbols! Your bid has been multiplied * 2!"
-    },
-}
+Account = namedtuple("Account", "id name balance created_at server member")
 
 SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
                     "{two.value} {two.value} {six.value} Bet * 2500\n"
@@ -110,11 +79,61 @@ SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
                     "Two symbols: Bet * 2".format(**SMReel.__dict__))
 
 
+class AccountLock:
+    """Holds the locks of several accounts for an async with block
+
+    They are always taken in the same order so two transfers between
+    the same accounts can't deadlock."""
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    async def __aenter__(self):
+        acquired = []
+        try:
+            for lock in self.locks:
+                await lock.acquire()
+                acquired.append(lock)
+        except:
+            for lock in reversed(acquired):
+                lock.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
 class Bank:
+    """
+    Bank accounts of every server
+
+    Balance changes are appended to a journal next to bank.json and
+    applied in memory. bank.json itself is rewritten in the background
+    every so often, and the journal is replayed onto it on load.
+
+    Commands that read a balance and then change it should hold
+    lock() for the accounts involved, and bulk operations should run
+    inside batch() so they are saved, or undone, together.
+    """
 
     def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
         self.bot = bot
+        self.journal = JsonJournal(file_path)
+        self.accounts = self.journal.load(self._apply, default={})
+        self.index = BalanceIndex(self.accounts)
+        self._locks = weakref.WeakValueDictionary()
+        # Only set while batch() is running
+        self._undo = None
+        self._batched = None
+
+    @staticmethod
+    def _apply(accounts, record):
+        if record.get("wipe"):
+            accounts[record["server"]] = {}
+        else:
+            server_accounts = accounts.setdefault(record["server"], {})
+            server_accounts[record["user"]] = record["account"]
 
     def create_account(self, user, *, initial_balance=0):
         server = user.server
@@ -130,8 +149,10 @@ class Bank:
                        "balance": balance,
                        "created_at": timestamp
                        }
+            self._remember(server.id, user.id)
             self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self.index.add(server.id, user.id, balance)
+            self._save_bank(self._account_record(user))
             return self.get_account(user)
         else:
             raise AccountAlreadyExists()
@@ -144,36 +165,26 @@ class Bank:
         return True
 
     def withdraw_credits(self, user, amount):
-        server = user.server
-
         if amount < 0:
             raise NegativeValue()
 
-        account = self._get_account(user)
-        if account["balance"] >= amount:
-            account["balance"] -= amount
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
+        balance = self.get_balance(user)
+        if balance >= amount:
+            self._save_bank(self._set_balance(user, balance - amount))
         else:
             raise InsufficientBalance()
 
     def deposit_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] += amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        balance = self.get_balance(user)
+        self._save_bank(self._set_balance(user, balance + amount))
 
     def set_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._get_account(user)
+        self._save_bank(self._set_balance(user, amount))
 
     def transfer_credits(self, sender, receiver, amount):
         if amount < 0:
@@ -181,24 +192,29 @@ class Bank:
         if sender is receiver:
             raise SameSenderAndReceiver()
         if self.account_exists(sender) and self.account_exists(receiver):
-            sender_acc = self._get_account(sender)
-            if sender_acc["balance"] < amount:
+            sender_balance = self.get_balance(sender)
+            if sender_balance < amount:
                 raise InsufficientBalance()
-            self.withdraw_credits(sender, amount)
-            self.deposit_credits(receiver, amount)
+            receiver_balance = self.get_balance(receiver)
+            # Both sides go to the journal in a single write
+            self._save_bank(
+                self._set_balance(sender, sender_balance - amount),
+                self._set_balance(receiver, receiver_balance + amount))
         else:
             raise NoAccount()
 
     def can_spend(self, user, amount):
-        account = self._get_account(user)
-        if account["balance"] >= amount:
+        if self.get_balance(user) >= amount:
             return True
         else:
             return False
 
     def wipe_bank(self, server):
+        for user_id in self.accounts.get(server.id, {}):
+            self._remember(server.id, user_id)
         self.accounts[server.id] = {}
-        self._save_bank()
+        self.index.clear(server.id)
+        self._save_bank({"server": server.id, "wipe": True})
 
     def get_server_accounts(self, server):
         if server.id in self.accounts:
@@ -229,9 +245,49 @@ class Bank:
                 accounts.append(acc)
         return accounts
 
+    def get_leaderboard(self, server=None, *, unique=False):
+        """Yields accounts of current members from the richest down
+
+        Covers every server the bot is still in if server is None, and
+        only each user's richest account if unique is True. Servers and
+        members are looked up as the accounts are consumed."""
+        seen = set()
+        for server_id, user_id, account in self._ranked_accounts(server):
+            if user_id in seen:
+                continue
+            account_server = server or self.bot.get_server(server_id)
+            if account_server is None:
+                continue
+            member = account_server.get_member(user_id)
+            if member is None:  # Left the server
+                continue
+            if unique:
+                seen.add(user_id)
+            account.update(id=user_id, server=account_server, member=member)
+            yield self._create_account_obj(account)
+
+    def _ranked_accounts(self, server):
+        for balance, user_id, server_id in self.index.top(
+                server and server.id):
+            yield server_id, user_id, dict(self.accounts[server_id][user_id])
+
+    def get_rank(self, user):
+        """Position of user in their server's leaderboard
+
+        Like get_leaderboard, accounts of members who left don't count."""
+        balance = self.get_balance(user)
+        server = user.server
+        return 1 + sum(1 for user_id in self._ids_ahead(user, balance)
+                       if server.get_member(user_id) is not None)
+
+    def _ids_ahead(self, user, balance):
+        return self.index.ahead(user.server.id, user.id, balance)
+
     def get_balance(self, user):
-        account = self._get_account(user)
-        return account["balance"]
+        try:
+            return self.accounts[user.server.id][user.id]["balance"]
+        except KeyError:
+            raise NoAccount()
 
     def get_account(self, user):
         acc = self._get_account(user)
@@ -240,15 +296,95 @@ class Bank:
         return self._create_account_obj(acc)
 
     def _create_account_obj(self, account):
-        account["member"] = account["server"].get_member(account["id"])
+        if "member" not in account:
+            account["member"] = account["server"].get_member(account["id"])
         account["created_at"] = datetime.strptime(account["created_at"],
                                                   "%Y-%m-%d %H:%M:%S")
-        Account = namedtuple("Account", "id name balance "
-                             "created_at server member")
         return Account(**account)
 
-    def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+    def _set_balance(self, user, balance):
+        self._remember(user.server.id, user.id)
+        account = self.accounts[user.server.id][user.id]
+        self.index.remove(user.server.id, user.id, account["balance"])
+        self.index.add(user.server.id, user.id, balance)
+        account["balance"] = balance
+        return self._account_record(user)
+
+    def _account_record(self, user):
+        return {"server": user.server.id, "user": user.id,
+                "account": self.accounts[user.server.id][user.id]}
+
+    def _save_bank(self, *records):
+        if self._batched is not None:
+            self._batched.extend(records)
+            return
+        if self.journal.append(*records):
+            self.bot.loop.create_task(
+                self.journal.compact_async(self.accounts, self.bot.loop))
+
+    def lock(self, *users):
+        """Returns an async context manager serializing the accounts
+        of users against other holders of the lock"""
+        locks = []
+        for key in sorted({(user.server.id, user.id) for user in users}):
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock(loop=self.bot.loop)
+            locks.append(lock)
+        return AccountLock(locks)
+
+    @contextmanager
+    def batch(self):
+        """Makes the credit operations inside the block one unit
+
+        They are written with a single journal append when the block
+        ends, or all undone if an exception escapes it."""
+        if self._undo is not None:  # Already part of a batch
+            yield
+            return
+        self._undo = {}
+        self._batched = []
+        try:
+            yield
+        except:
+            self._rollback()
+            raise
+        else:
+            records = self._batched
+        finally:
+            self._undo = None
+            self._batched = None
+        if records:
+            self._save_bank(*records)
+
+    def _remember(self, server_id, user_id):
+        if self._undo is None or (server_id, user_id) in self._undo:
+            return
+        account = self.accounts.get(server_id, {}).get(user_id)
+        self._undo[(server_id, user_id)] = deepcopy(account)
+
+    def _rollback(self):
+        for (server_id, user_id), account in self._undo.items():
+            server_accounts = self.accounts.setdefault(server_id, {})
+            current = server_accounts.pop(user_id, None)
+            if current is not None:
+                self.index.remove(server_id, user_id, current["balance"])
+            if account is not None:
+                server_accounts[user_id] = account
+                self.index.add(server_id, user_id, account["balance"])
+
+    def export(self):
+        """Returns every account in the bank.json layout"""
+        return deepcopy(self.accounts)
+
+    def import_accounts(self, accounts):
+        """Replaces every account with the ones from export"""
+        self.accounts = deepcopy(accounts)
+        self.index = BalanceIndex(self.accounts)
+        self.journal.compact(self.accounts)
+
+    def close(self):
+        self.journal.compact(self.accounts)
 
     def _get_account(self, user):
         server = user.server
@@ -258,6 +394,252 @@ class Bank:
             raise NoAccount()
 
 
+class SQLiteBank(Bank):
+    """
+    Bank accounts in an SQLite database
+
+    Balance changes are single UPDATE statements and transfers run in
+    one transaction, so nothing has to be held in memory or rewritten
+    as a whole. Leaderboards and ranks are answered from the indexes.
+    A batch() is a single transaction.
+    """
+
+    def __init__(self, bot, file_path):
+        self.bot = bot
+        self._locks = weakref.WeakValueDictionary()
+        self.batching = False
+        self.db = sqlite3.connect(file_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS accounts (
+                    server_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    balance INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (server_id, user_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS accounts_by_server_balance
+                    ON accounts (server_id, balance DESC, user_id);
+                CREATE INDEX IF NOT EXISTS accounts_by_balance
+                    ON accounts (balance DESC, user_id, server_id);
+                CREATE TABLE IF NOT EXISTS legacy_accounts (
+                    user_id TEXT PRIMARY KEY,
+                    balance INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );""")
+
+    @property
+    def imported(self):
+        """Whether accounts were ever imported into this database"""
+        row = self.db.execute("SELECT value FROM meta "
+                              "WHERE key = 'imported'").fetchone()
+        return row is not None
+
+    def create_account(self, user, *, initial_balance=0):
+        server = user.server
+        if self.account_exists(user):
+            raise AccountAlreadyExists()
+        row = self.db.execute("SELECT balance FROM legacy_accounts "
+                              "WHERE user_id = ?", (user.id,)).fetchone()
+        balance = row["balance"] if row else initial_balance
+        timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._transaction():
+            self.db.execute("INSERT INTO accounts VALUES (?, ?, ?, ?, ?)",
+                            (server.id, user.id, user.name, balance,
+                             timestamp))
+        return self.get_account(user)
+
+    def withdraw_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        with self._transaction():
+            self._withdraw(user, amount)
+
+    def deposit_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        with self._transaction():
+            self._deposit(user, amount)
+
+    def set_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE accounts SET balance = ? "
+                "WHERE server_id = ? AND user_id = ?",
+                (amount, user.server.id, user.id))
+        if cursor.rowcount == 0:
+            raise NoAccount()
+
+    def transfer_credits(self, sender, receiver, amount):
+        if amount < 0:
+            raise NegativeValue()
+        if sender is receiver:
+            raise SameSenderAndReceiver()
+        if not self.account_exists(receiver):
+            raise NoAccount()
+        # Rolled back as a whole if either side fails
+        with self._transaction():
+            self._withdraw(sender, amount)
+            self._deposit(receiver, amount)
+
+    def _withdraw(self, user, amount):
+        cursor = self.db.execute(
+            "UPDATE accounts SET balance = balance - ? "
+            "WHERE server_id = ? AND user_id = ? AND balance >= ?",
+            (amount, user.server.id, user.id, amount))
+        if cursor.rowcount == 0:
+            self._get_account(user)  # Raises NoAccount first
+            raise InsufficientBalance()
+
+    def _deposit(self, user, amount):
+        cursor = self.db.execute(
+            "UPDATE accounts SET balance = balance + ? "
+            "WHERE server_id = ? AND user_id = ?",
+            (amount, user.server.id, user.id))
+        if cursor.rowcount == 0:
+            raise NoAccount()
+
+    @contextmanager
+    def batch(self):
+        if self.batching:
+            yield
+            return
+        self.batching = True
+        try:
+            with self.db:
+                yield
+        finally:
+            self.batching = False
+
+    @contextmanager
+    def _transaction(self):
+        if self.batching:
+            yield
+        else:
+            with self.db:
+                yield
+
+    def wipe_bank(self, server):
+        with self._transaction():
+            self.db.execute("DELETE FROM accounts WHERE server_id = ?",
+                            (server.id,))
+
+    def get_server_accounts(self, server):
+        cursor = self.db.execute("SELECT * FROM accounts WHERE server_id = ?",
+                                 (server.id,))
+        return [self._row_to_account(row, server) for row in cursor]
+
+    def get_all_accounts(self):
+        accounts = []
+        for row in self.db.execute("SELECT * FROM accounts"):
+            server = self.bot.get_server(row["server_id"])
+            if server is not None:
+                accounts.append(self._row_to_account(row, server))
+        return accounts
+
+    def _ranked_accounts(self, server):
+        if server is None:
+            cursor = self.db.execute("SELECT * FROM accounts "
+                                     "ORDER BY balance DESC, user_id, "
+                                     "server_id")
+        else:
+            cursor = self.db.execute("SELECT * FROM accounts "
+                                     "WHERE server_id = ? "
+                                     "ORDER BY balance DESC, user_id",
+                                     (server.id,))
+        for row in cursor:
+            yield row["server_id"], row["user_id"], self._row_to_dict(row)
+
+    def _ids_ahead(self, user, balance):
+        cursor = self.db.execute(
+            "SELECT user_id FROM accounts WHERE server_id = ? AND "
+            "(balance > ? OR (balance = ? AND user_id < ?))",
+            (user.server.id, balance, balance, user.id))
+        return (row["user_id"] for row in cursor)
+
+    def get_balance(self, user):
+        return self._get_account(user)["balance"]
+
+    def export(self):
+        accounts = {}
+        for row in self.db.execute("SELECT * FROM accounts"):
+            server_accounts = accounts.setdefault(row["server_id"], {})
+            server_accounts[row["user_id"]] = self._row_to_dict(row)
+        for row in self.db.execute("SELECT * FROM legacy_accounts"):
+            accounts[row["user_id"]] = {"balance": row["balance"]}
+        return accounts
+
+    def import_accounts(self, accounts):
+        rows = []
+        legacy = []
+        for key, value in accounts.items():
+            if "balance" in value:  # Legacy account
+                legacy.append((key, value["balance"]))
+                continue
+            for user_id, account in value.items():
+                rows.append((key, user_id, account["name"],
+                             account["balance"], account["created_at"]))
+        with self.db:
+            self.db.execute("DELETE FROM accounts")
+            self.db.execute("DELETE FROM legacy_accounts")
+            self.db.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?, ?)",
+                                rows)
+            self.db.executemany("INSERT INTO legacy_accounts VALUES (?, ?)",
+                                legacy)
+            self.db.execute("INSERT OR REPLACE INTO meta "
+                            "VALUES ('imported', ?)",
+                            (datetime.utcnow().isoformat(),))
+
+    def close(self):
+        self.db.close()
+
+    def _get_account(self, user):
+        row = self.db.execute("SELECT * FROM accounts "
+                              "WHERE server_id = ? AND user_id = ?",
+                              (user.server.id, user.id)).fetchone()
+        if row is None:
+            raise NoAccount()
+        return self._row_to_dict(row)
+
+    def _row_to_account(self, row, server):
+        account = self._row_to_dict(row)
+        account["id"] = row["user_id"]
+        account["server"] = server
+        return self._create_account_obj(account)
+
+    @staticmethod
+    def _row_to_dict(row):
+        return {"name": row["name"], "balance": row["balance"],
+                "created_at": row["created_at"]}
+
+
+def open_bank(bot, backend):
+    """Opens the bank for backend, migrating bank.json into the
+    database until a migration has completed"""
+    path = bank_paths[backend]
+    if backend == "sqlite":
+        bank = SQLiteBank(bot, path)
+        if not bank.imported:
+            try:
+                json_bank = Bank(bot, bank_paths["json"])
+                bank.import_accounts(json_bank.export())
+                json_bank.close()
+            except:
+                bank.close()
+                raise
+        return bank
+    return Bank(bot, path)
+
+
 class SetParser:
     def __init__(self, argument):
         allowed = ("+", "-")
@@ -288,7 +670,8 @@ class Economy:
     def __init__(self, bot):
         global default_settings
         self.bot = bot
-        self.bank = Bank(bot, "data/economy/bank.json")
+        self.bank_settings = dataIO.load_json(bank_settings_path)
+        self.bank = open_bank(bot, self.bank_settings["BACKEND"])
         self.file_path = "data/economy/settings.json"
         self.settings = dataIO.load_json(self.file_path)
         if "PAYDAY_TIME" in self.settings:  # old format
@@ -298,6 +681,9 @@ class Economy:
         self.payday_register = defaultdict(dict)
         self.slot_register = defaultdict(dict)
 
+    def __unload(self):
+        self.bank.close()
+
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
         """Bank operations"""
@@ -328,8 +714,11 @@ class Economy:
         if not user:
             user = ctx.message.author
             try:
-                await self.bot.say("{} Your balance is: {}".format(
-                    user.mention, self.bank.get_balance(user)))
+                await self.bot.say("{} Your balance is: {} (#{} on this "
+                                   "server)".format(
+                                       user.mention,
+                                       self.bank.get_balance(user),
+                                       self.bank.get_rank(user)))
             except NoAccount:
                 await self.bot.say("{} You don't have an account at the"
                                    " Twentysix bank. Type `{}bank register`"
@@ -347,7 +736,8 @@ class Economy:
         """Transfer credits to other users"""
         author = ctx.message.author
         try:
-            self.bank.transfer_credits(author, user, sum)
+            async with self.bank.lock(author, user):
+                self.bank.transfer_credits(author, user, sum)
             logger.info("{}({}) transferred {} credits to {}({})".format(
                 author.name, author.id, sum, user.name, user.id))
             await self.bot.say("{} credits have been transferred to {}'s"
@@ -398,6 +788,35 @@ class Economy:
         except NoAccount:
             await self.bot.say("User has no bank account.")
 
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def grant(self, ctx, credits: int, role: discord.Role=None):
+        """Gives credits to every account holder of the server
+
+        Pass a role to only give them to its members"""
+        author = ctx.message.author
+        server = ctx.message.server
+        if credits < 1:
+            await self.bot.say("You need to grant at least 1 credit.")
+            return
+        members = [m for m in server.members
+                   if (role is None or role in m.roles) and
+                   self.bank.account_exists(m)]
+        granted = 0
+        async with self.bank.lock(*members):
+            with self.bank.batch():
+                for member in members:
+                    try:
+                        self.bank.deposit_credits(member, credits)
+                    except NoAccount:  # Closed while waiting for the lock
+                        continue
+                    granted += 1
+        logger.info("{}({}) granted {} credits to {} accounts on {}({})"
+                    "".format(author.name, author.id, credits, granted,
+                              server.name, server.id))
+        await self.bot.say("{} credits have been given to {} accounts."
+                           "".format(credits, granted))
+
     @_bank.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
     async def reset(self, ctx, confirmation: bool=False):
@@ -417,38 +836,29 @@ class Economy:
         author = ctx.message.author
         server = author.server
         id = author.id
-        if self.bank.account_exists(author):
+        settings = self.settings[server.id]
+        if not self.bank.account_exists(author):
+            await self.bot.say("{} You need an account to receive credits."
+                               " Type `{}bank register` to open one.".format(
+                                   author.mention, ctx.prefix))
+            return
+        async with self.bank.lock(author):
             if id in self.payday_register[server.id]:
                 seconds = abs(self.payday_register[server.id][
                               id] - int(time.perf_counter()))
-                if seconds >= self.settings[server.id]["PAYDAY_TIME"]:
-                    self.bank.deposit_credits(author, self.settings[
-                                              server.id]["PAYDAY_CREDITS"])
-                    self.payday_register[server.id][
-                        id] = int(time.perf_counter())
-                    await self.bot.say(
-                        "{} Here, take some credits. Enjoy! (+{}"
-                        " credits!)".format(
-                            author.mention,
-                            str(self.settings[server.id]["PAYDAY_CREDITS"])))
-                else:
-                    dtime = self.display_time(
-                        self.settings[server.id]["PAYDAY_TIME"] - seconds)
-                    await self.bot.say(
-                        "{} Too soon. For your next payday you have to"
-                        " wait {}.".format(author.mention, dtime))
             else:
+                seconds = None
+            if seconds is None or seconds >= settings["PAYDAY_TIME"]:
+                self.bank.deposit_credits(author, settings["PAYDAY_CREDITS"])
                 self.payday_register[server.id][id] = int(time.perf_counter())
-                self.bank.deposit_credits(author, self.settings[
-                                          server.id]["PAYDAY_CREDITS"])
                 await self.bot.say(
                     "{} Here, take some credits. Enjoy! (+{} credits!)".format(
-                        author.mention,
-                        str(self.settings[server.id]["PAYDAY_CREDITS"])))
-        else:
-            await self.bot.say("{} You need an account to receive credits."
-                               " Type `{}bank register` to open one.".format(
-                                   author.mention, ctx.prefix))
+                        author.mention, str(settings["PAYDAY_CREDITS"])))
+            else:
+                dtime = self.display_time(settings["PAYDAY_TIME"] - seconds)
+                await self.bot.say(
+                    "{} Too soon. For your next payday you have to"
+                    " wait {}.".format(author.mention, dtime))
 
     @commands.group(pass_context=True)
     async def leaderboard(self, ctx):
@@ -470,12 +880,8 @@ class Economy:
         server = ctx.message.server
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_server_accounts(server),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if a.member] #  exclude users who left
-        if len(bank_sorted) < top:
-            top = len(bank_sorted)
-        topten = bank_sorted[:top]
+        topten = list(islice(self.bank.get_leaderboard(server), top))
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -496,16 +902,9 @@ class Economy:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if a.member] #  exclude users who left
-        unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
-                unique_accounts.append(acc)
-        if len(unique_accounts) < top:
-            top = len(unique_accounts)
-        topten = unique_accounts[:top]
+        leaderboard = self.bank.get_leaderboard(unique=True)
+        topten = list(islice(leaderboard, top))
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -520,12 +919,6 @@ class Economy:
         else:
             await self.bot.say("There are no accounts in the bank.")
 
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
-
     @commands.command()
     async def payouts(self):
         """Shows slot machine payouts"""
@@ -539,17 +932,20 @@ class Economy:
         settings = self.settings[server.id]
         valid_bid = settings["SLOT_MIN"] <= bid and bid <= settings["SLOT_MAX"]
         slot_time = settings["SLOT_TIME"]
-        last_slot = self.slot_register.get(author.id)
-        now = datetime.utcnow()
         try:
-            if last_slot:
-                if (now - last_slot).seconds < slot_time:
-                    raise OnCooldown()
             if not valid_bid:
                 raise InvalidBid()
-            if not self.bank.can_spend(author, bid):
-                raise InsufficientBalance
-            await self.slot_machine(author, bid)
+            async with self.bank.lock(author):
+                # Read after the lock so a queued spin sees the previous
+                # spin's time
+                now = datetime.utcnow()
+                last_slot = self.slot_register.get(author.id)
+                if last_slot:
+                    if (now - last_slot).total_seconds() < slot_time:
+                        raise OnCooldown()
+                if not self.bank.can_spend(author, bid):
+                    raise InsufficientBalance
+                await self.slot_machine(author, bid)
         except NoAccount:
             await self.bot.say("{} You need an account to use the slot "
                                "machine. Type `{}bank register` to open one."
@@ -566,16 +962,8 @@ class Economy:
                                          settings["SLOT_MAX"]))
 
     async def slot_machine(self, author, bid):
-        default_reel = deque(SMReel)
-        reels = []
         self.slot_register[author.id] = datetime.utcnow()
-        for i in range(3):
-            default_reel.rotate(random.randint(-999, 999)) # weeeeee
-            new_reel = deque(default_reel, maxlen=3) # we need only 3 symbols
-            reels.append(new_reel)                   # for each reel
-        rows = ((reels[0][0], reels[1][0], reels[2][0]),
-                (reels[0][1], reels[1][1], reels[2][1]),
-                (reels[0][2], reels[1][2], reels[2][2]))
+        rows = spin_reels()
 
         slot = "~~\n~~" # Mobile friendly
         for i, row in enumerate(rows): # Let's build the slot to show
@@ -584,21 +972,7 @@ class Economy:
                 sign = ">"
             slot += "{}{} {} {}\n".format(sign, *[c.value for c in row])
 
-        payout = PAYOUTS.get(rows[1])
-        if not payout:
-            # Checks for two-consecutive-symbols special rewards
-            payout = PAYOUTS.get((rows[1][0], rows[1][1]),
-                     PAYOUTS.get((rows[1][1], rows[1][2]))
-                                )
-        if not payout:
-            # Still nothing. Let's check for 3 generic same symbols
-            # or 2 consecutive symbols
-            has_three = rows[1][0] == rows[1][1] == rows[1][2]
-            has_two = (rows[1][0] == rows[1][1]) or (rows[1][1] == rows[1][2])
-            if has_three:
-                payout = PAYOUTS["3 symbols"]
-            elif has_two:
-                payout = PAYOUTS["2 symbols"]
+        payout = find_payout(rows[1])
 
         if payout:
             then = self.bank.get_balance(author)
@@ -682,6 +1056,60 @@ class Economy:
                            "".format(credits))
         dataIO.save_json(self.file_path, self.settings)
 
+    @economyset.command(pass_context=True, name="slotsim")
+    @checks.is_owner()
+    async def slot_simulation(self, ctx, spins: int=1000000):
+        """Simulates the slot machine at this server's bid limits
+
+        Shows the return to player, how often a spin pays anything and
+        the variance of a spin's result in credits"""
+        settings = self.settings[ctx.message.server.id]
+        spins = max(1, min(spins, MAX_SIMULATED_SPINS))
+        bids = sorted({settings["SLOT_MIN"], settings["SLOT_MAX"],
+                       (settings["SLOT_MIN"] + settings["SLOT_MAX"]) // 2})
+        bids = [b for b in bids if b > 0]
+        if not bids:
+            await self.bot.say("Set a positive slot machine bid first.")
+            return
+        msg = "{:<8}{:>10}{:>10}{:>16}\n".format("Bid", "RTP", "Hits",
+                                                 "Variance")
+        for bid in bids:
+            try:
+                stats = await self.bot.loop.run_in_executor(
+                    None, partial(simulate, bid, spins))
+            except RuntimeError as e:
+                await self.bot.say(str(e))
+                return
+            msg += "{:<8}{:>10.2%}{:>10.2%}{:>16.1f}\n".format(
+                bid, stats.rtp, stats.hit_frequency, stats.variance)
+        await self.bot.say("{} spins per bid:\n{}".format(spins, box(msg)))
+
+    @economyset.command(name="bankbackend")
+    @checks.is_owner()
+    async def bank_backend(self, backend: str):
+        """Sets where bank accounts are stored: json or sqlite
+
+        Every account is copied over to the new backend"""
+        backend = backend.lower()
+        if backend not in bank_paths:
+            await self.bot.say("Backend must be one of: {}"
+                               "".format(", ".join(sorted(bank_paths))))
+            return
+        if backend == self.bank_settings["BACKEND"]:
+            await self.bot.say("The bank already uses {}.".format(backend))
+            return
+        accounts = self.bank.export()
+        self.bank.close()
+        if backend == "sqlite":
+            self.bank = SQLiteBank(self.bot, bank_paths[backend])
+        else:
+            self.bank = Bank(self.bot, bank_paths[backend])
+        self.bank.import_accounts(accounts)
+        self.bank_settings["BACKEND"] = backend
+        dataIO.save_json(bank_settings_path, self.bank_settings)
+        await self.bot.say("Bank accounts are now stored in {}."
+                           "".format(backend))
+
     # What would I ever do without stackoverflow?
     def display_time(self, seconds, granularity=2):
         intervals = (  # Source: http://stackoverflow.com/a/24542445
@@ -722,6 +1150,10 @@ def check_files():
         print("Creating empty bank.json...")
         dataIO.save_json(f, {})
 
+    if not dataIO.is_valid_json(bank_settings_path):
+        print("Creating default economy's bank_settings.json...")
+        dataIO.save_json(bank_settings_path, default_bank_settings)
+
 
 def setup(bot):
     global logger
@@ -1,15 +1,24 @@
 import discord
 from discord.ext import commands
-from .utils.dataIO import dataIO
+from .utils.dataIO import dataIO, JsonJournal
 from .utils import checks
+from .utils.ratelimit import gather_with_backoff
+from .utils.wordfilter import build_filter_pattern
+from .utils.repeats import RepeatTracker
+from .utils.mentions import MentionRateTracker
+from .utils.cleanup import stream_deletions
+from .utils.idsets import load_id_sets, save_id_sets
 from __main__ import send_cmd_help, settings
-from datetime import datetime
-from collections import deque, defaultdict, OrderedDict
+from datetime import datetime, timedelta
+from collections import defaultdict
+from bisect import insort
+from functools import partial
 from cogs.utils.chat_formatting import escape_mass_mentions, box, pagify
 import os
 import re
 import logging
 import asyncio
+import time
 
 
 ACTIONS_REPR = {
@@ -32,8 +41,22 @@ ACTIONS_CASES = {
     "UNBAN"   : True
 }
 
+# Past names/nicknames kept per user and how often changes are written
+NAME_HISTORY_LENGTH = 20
+NAME_FLUSH_INTERVAL = 60
+NAME_FLUSH_THRESHOLD = 1000
+
+# Channel overwrites edited at once by server mute/unmute
+OVERWRITE_CONCURRENCY = 5
+
+# History read per cleanup
+CLEANUP_SCAN_LIMIT = 10000
+# A little under 14 days so messages don't age out mid purge
+BULK_DELETE_MAX_AGE = timedelta(days=13, hours=23)
+
 default_settings = {
     "ban_mention_spam"  : False,
+    "ban_mention_rate"  : False,
     "delete_repeats"    : False,
     "mod-log"           : None,
     "respect_hierarchy" : False
@@ -65,6 +88,99 @@ class NoModLogAccess(ModError):
     pass
 
 
+class CaseStore:
+    """
+    Mod-log cases with indexes by user and moderator
+
+    Every created or amended case appends one record to a journal next
+    to modlog.json, which is rewritten in the background every so
+    often instead of on each action.
+    """
+    def __init__(self, bot, filename="data/mod/modlog.json"):
+        self.bot = bot
+        self.journal = JsonJournal(filename)
+        self.cases = self.journal.load(self._apply, default={})
+        # (server id, user id) -> sorted case numbers
+        self.by_user = defaultdict(list)
+        self.by_moderator = defaultdict(list)
+        for server_id, cases in self.cases.items():
+            for case in cases.values():
+                self._index(server_id, case)
+
+    @staticmethod
+    def _apply(cases, record):
+        if record.get("reset"):
+            cases[record["server"]] = {}
+        else:
+            case = record["case"]
+            cases.setdefault(record["server"], {})[str(case["case"])] = case
+
+    def _index(self, server_id, case):
+        insort(self.by_user[(server_id, case["user_id"])], case["case"])
+        if case["moderator_id"] is not None:
+            key = (server_id, case["moderator_id"])
+            insort(self.by_moderator[key], case["case"])
+
+    def _unindex(self, server_id, case):
+        self.by_user[(server_id, case["user_id"])].remove(case["case"])
+        if case["moderator_id"] is not None:
+            key = (server_id, case["moderator_id"])
+            self.by_moderator[key].remove(case["case"])
+
+    def get(self, server_id, case_n):
+        """Returns a copy of a case, raises KeyError if it doesn't exist"""
+        return self.cases[server_id][str(case_n)].copy()
+
+    def count(self, server_id):
+        return len(self.cases.get(server_id, {}))
+
+    def for_user(self, server_id, user_id):
+        return [self.get(server_id, n)
+                for n in self.by_user.get((server_id, user_id), [])]
+
+    def last_by_moderator(self, server_id, mod_id):
+        cases = self.by_moderator.get((server_id, mod_id))
+        return cases[-1] if cases else None
+
+    def save(self, server_id, case):
+        """Creates or amends a case"""
+        cases = self.cases.setdefault(server_id, {})
+        old = cases.get(str(case["case"]))
+        if old is not None:
+            self._unindex(server_id, old)
+        cases[str(case["case"])] = case
+        self._index(server_id, case)
+        self._append({"server": server_id, "case": case})
+
+    def reset(self, server_id):
+        for case in self.cases.get(server_id, {}).values():
+            self._unindex(server_id, case)
+        self.cases[server_id] = {}
+        self._append({"server": server_id, "reset": True})
+
+    def _append(self, record):
+        if self.journal.append(record):
+            self.bot.loop.create_task(
+                self.journal.compact_async(self.cases, self.bot.loop))
+
+    def close(self):
+        self.journal.compact(self.cases)
+
+
+class MessageView:
+    """A message normalized once for every moderation rule"""
+    __slots__ = ("message", "server", "author", "content", "lowered",
+                 "mentions")
+
+    def __init__(self, message):
+        self.message = message
+        self.server = message.server
+        self.author = message.author
+        self.content = message.content
+        self.lowered = message.content.lower()
+        self.mentions = len(set(message.mentions))
+
+
 class TempCache:
     """
     This is how we avoid events such as ban and unban
@@ -94,19 +210,31 @@ class Mod:
 
     def __init__(self, bot):
         self.bot = bot
-        self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self.ignore_list = load_id_sets("data/mod/ignorelist.json")
         self.filter = dataIO.load_json("data/mod/filter.json")
+        self.filter_patterns = {}
+        self.rule_plans = {}
+        # name -> [inspections, seconds spent inspecting, enforced]
+        self.rule_stats = defaultdict(lambda: [0, 0.0, 0])
         self.past_names = dataIO.load_json("data/mod/past_names.json")
         self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        # Name changes are written behind, see flush_names
+        self.names_dirty = False
+        self.nicknames_dirty = False
+        self.pending_name_changes = 0
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
-        self.cache = OrderedDict()
-        self.cases = dataIO.load_json("data/mod/modlog.json")
-        self.last_case = defaultdict(dict)
+        self.repeats = RepeatTracker()
+        self.mention_rates = MentionRateTracker()
+        self.case_store = CaseStore(bot)
         self.temp_cache = TempCache(bot)
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
         self._perms_cache = defaultdict(dict, perms_cache)
 
+    def __unload(self):
+        self.case_store.close()
+        self.flush_names()
+
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
     async def modset(self, ctx):
@@ -120,12 +248,18 @@ class Mod:
                 _settings["respect_hierarchy"] = default_settings["respect_hierarchy"]
             if "delete_delay" not in _settings:
                 _settings["delete_delay"] = "Disabled"
+            rate = _settings.get("ban_mention_rate")
+            if rate:
+                _settings["ban_mention_rate"] = "{} in {}s".format(*rate)
+            else:
+                _settings["ban_mention_rate"] = False
 
             msg = ("Admin role: {ADMIN_ROLE}\n"
                    "Mod role: {MOD_ROLE}\n"
                    "Mod-log: {mod-log}\n"
                    "Delete repeats: {delete_repeats}\n"
                    "Ban mention spam: {ban_mention_spam}\n"
+                   "Ban mention rate: {ban_mention_rate}\n"
                    "Delete delay: {delete_delay}\n"
                    "Respects hierarchy: {respect_hierarchy}"
                    "".format(**_settings))
@@ -181,6 +315,33 @@ class Mod:
                 return
             self.settings[server.id]["ban_mention_spam"] = False
             await self.bot.say("Autoban for mention spam disabled.")
+        self.rule_plans.pop(server.id, None)
+        dataIO.save_json("data/mod/settings.json", self.settings)
+
+    @modset.command(pass_context=True, no_pm=True)
+    async def banmentionrate(self, ctx, max_mentions : int=False,
+                             seconds : int=60):
+        """Enables auto ban for mentioning X people within Y seconds
+
+        Counts mentions across messages, unlike banmentionspam.
+        Accepted values: 5 or more mentions, 5 to 3600 seconds"""
+        server = ctx.message.server
+        if max_mentions:
+            max_mentions = max(max_mentions, 5)
+            seconds = min(max(seconds, 5), 3600)
+            self.settings[server.id]["ban_mention_rate"] = [max_mentions,
+                                                            seconds]
+            await self.bot.say("Autoban for mention rate enabled. "
+                               "Anyone mentioning {} or more people "
+                               "within {} seconds will be autobanned."
+                               "".format(max_mentions, seconds))
+        else:
+            if not self.settings[server.id].get("ban_mention_rate"):
+                await send_cmd_help(ctx)
+                return
+            self.settings[server.id]["ban_mention_rate"] = False
+            await self.bot.say("Autoban for mention rate disabled.")
+        self.rule_plans.pop(server.id, None)
         dataIO.save_json("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
@@ -194,14 +355,14 @@ class Mod:
         else:
             self.settings[server.id]["delete_repeats"] = False
             await self.bot.say("Repeated messages will be ignored.")
+        self.rule_plans.pop(server.id, None)
         dataIO.save_json("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def resetcases(self, ctx):
         """Resets modlog's cases"""
         server = ctx.message.server
-        self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.case_store.reset(server.id)
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -553,30 +714,34 @@ class Mod:
                                "hierarchy.")
             return
 
-        register = {}
+        previous = {}
+        edits = []
         for channel in server.channels:
             if channel.type != discord.ChannelType.text:
                 continue
             overwrites = channel.overwrites_for(user)
             if overwrites.send_messages is False:
                 continue
-            register[channel.id] = overwrites.send_messages
+            previous[channel.id] = overwrites.send_messages
             overwrites.send_messages = False
-            try:
-                await self.bot.edit_channel_permissions(channel, user,
-                                                        overwrites)
-            except discord.Forbidden:
-                await self.bot.say("Failed to mute user. I need the manage roles "
-                                   "permission and the user I'm muting must be "
-                                   "lower than myself in the role hierarchy.")
-                return
-            else:
-                await asyncio.sleep(0.1)
-        if not register:
+            edits.append((channel, partial(self.bot.edit_channel_permissions,
+                                           channel, user, overwrites)))
+        if not edits:
             await self.bot.say("That user is already muted in all channels.")
             return
-        self._perms_cache[user.id] = register
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+
+        done, failed = await self.apply_overwrites(edits)
+        if done:
+            # Recorded in one go so unmute can restore every edited channel
+            register = {c: previous[c] for c in done}
+            self._perms_cache[user.id].update(register)
+            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        if failed:
+            await self.bot.say("Failed to mute user in {} channels. I need the "
+                               "manage roles permission and the user I'm "
+                               "muting must be lower than myself in the role "
+                               "hierarchy.".format(len(failed)))
+            return
         await self.new_case(server,
                             action="SMUTE",
                             mod=author,
@@ -656,6 +821,7 @@ class Mod:
                                "hierarchy.")
             return
 
+        edits = []
         for channel in server.channels:
             if channel.type != discord.ChannelType.text:
                 continue
@@ -665,24 +831,26 @@ class Mod:
             overwrites = channel.overwrites_for(user)
             if overwrites.send_messages is False:
                 overwrites.send_messages = value
-                is_empty = self.are_overwrites_empty(overwrites)
-                try:
-                    if not is_empty:
-                        await self.bot.edit_channel_permissions(channel, user,
-                                                                overwrites)
-                    else:
-                        await self.bot.delete_channel_permissions(channel, user)
-                except discord.Forbidden:
-                    await self.bot.say("Failed to unmute user. I need the manage roles"
-                                       " permission and the user I'm unmuting must be "
-                                       "lower than myself in the role hierarchy.")
-                    return
+                if not self.are_overwrites_empty(overwrites):
+                    edit = partial(self.bot.edit_channel_permissions,
+                                   channel, user, overwrites)
                 else:
-                    del self._perms_cache[user.id][channel.id]
-                    await asyncio.sleep(0.1)
+                    edit = partial(self.bot.delete_channel_permissions,
+                                   channel, user)
+                edits.append((channel, edit))
+
+        done, failed = await self.apply_overwrites(edits)
+        for channel_id in done:
+            del self._perms_cache[user.id][channel_id]
         if user.id in self._perms_cache and not self._perms_cache[user.id]:
             del self._perms_cache[user.id]  # cleanup
         dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        if failed:
+            await self.bot.say("Failed to unmute user in {} channels. I need "
+                               "the manage roles permission and the user I'm "
+                               "unmuting must be lower than myself in the "
+                               "role hierarchy.".format(len(failed)))
+            return
         await self.bot.say("User has been unmuted in this server.")
 
     @commands.group(pass_context=True)
@@ -715,31 +883,18 @@ class Mod:
             else:
                 return False
 
-        to_delete = [ctx.message]
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.stream_cleanup(channel, check, number,
+                                            before=ctx.message,
+                                            include=[ctx.message],
+                                            bulk=is_bot)
 
         logger.info("{}({}) deleted {} messages "
                     " containing '{}' in channel {}".format(author.name,
-                    author.id, len(to_delete), text, channel.id))
-
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
+                    author.id, deleted, text, channel.id))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def user(self, ctx, user: discord.Member, number: int):
@@ -764,34 +919,21 @@ class Mod:
             else:
                 return False
 
-        to_delete = [ctx.message]
-
         if not has_permissions and not self_delete:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        # For whatever reason the purge endpoint requires manage_messages
+        deleted = await self.stream_cleanup(channel, check, number,
+                                            before=ctx.message,
+                                            include=[ctx.message],
+                                            bulk=is_bot and not self_delete)
 
         logger.info("{}({}) deleted {} messages "
                     " made by {}({}) in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               user.name, user.id, channel.name))
 
-        if is_bot and not self_delete:
-            # For whatever reason the purge endpoint requires manage_messages
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, no_pm=True)
     async def after(self, ctx, message_id : int):
         """Deletes all messages after specified message
@@ -814,8 +956,6 @@ class Mod:
                                "bot accounts.")
             return
 
-        to_delete = []
-
         after = await self.bot.get_message(channel, message_id)
 
         if not has_permissions:
@@ -825,15 +965,12 @@ class Mod:
             await self.bot.say("Message not found.")
             return
 
-        async for message in self.bot.logs_from(channel, limit=2000,
-                                                after=after):
-            to_delete.append(message)
+        deleted = await self.stream_cleanup(channel, lambda m: True, 2000,
+                                            after=after)
 
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
-                              len(to_delete), channel.name))
-
-        await self.mass_purge(to_delete)
+                              deleted, channel.name))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def messages(self, ctx, number: int):
@@ -848,23 +985,17 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        to_delete = []
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        async for message in self.bot.logs_from(channel, limit=number+1):
-            to_delete.append(message)
+        # The command message is the first one in the history
+        deleted = await self.stream_cleanup(channel, lambda m: True,
+                                            number + 1, bulk=is_bot)
 
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
-                              number, channel.name))
-
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
+                              deleted, channel.name))
 
     @cleanup.command(pass_context=True, no_pm=True, name='bot')
     async def cleanup_bot(self, ctx, number: int):
@@ -899,33 +1030,20 @@ class Mod:
                 return m.content[len(p):].startswith(tuple(self.bot.commands))
             return False
 
-        to_delete = [ctx.message]
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.stream_cleanup(channel, check, number,
+                                            before=ctx.message,
+                                            include=[ctx.message],
+                                            bulk=is_bot)
 
         logger.info("{}({}) deleted {} "
                     " command messages in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel.name))
 
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, name='self')
     async def cleanup_self(self, ctx, number: int, match_pattern: str = None):
         """Cleans up messages owned by the bot.
@@ -971,22 +1089,15 @@ class Mod:
                 return True
             return False
 
-        to_delete = []
+        include = []
         # Selfbot convenience, delete trigger message
         if author == self.bot.user:
-            to_delete.append(ctx.message)
-            number += 1
-
-        tries_left = 5
-        tmp = ctx.message
+            include.append(ctx.message)
 
-        while tries_left and len(to_delete) < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        deleted = await self.stream_cleanup(channel, check, number,
+                                            before=ctx.message,
+                                            include=include,
+                                            bulk=is_bot and can_mass_purge)
 
         if channel.name:
             channel_name = 'channel ' + channel.name
@@ -995,14 +1106,9 @@ class Mod:
 
         logger.info("{}({}) deleted {} messages "
                     "sent by the bot in {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel_name))
 
-        if is_bot and can_mass_purge:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @commands.command(pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def reason(self, ctx, case, *, reason : str=""):
@@ -1021,7 +1127,7 @@ class Mod:
                 reason = "{} {}".format(case, reason)
             else:
                 reason = case
-            case = self.last_case[server.id].get(author.id)
+            case = self.case_store.last_by_moderator(server.id, author.id)
             if case is None:
                 await send_cmd_help(ctx)
                 return
@@ -1042,6 +1148,29 @@ class Mod:
         else:
             await self.bot.say("Case #{} updated.".format(case))
 
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def cases(self, ctx, *, user: str):
+        """Lists mod-log cases of a user
+
+        Accepts a mention or a user ID, so users that left can be looked up"""
+        server = ctx.message.server
+        match = re.match(r'<@!?([0-9]+)>$', user) or re.match(r'([0-9]+)$', user)
+        if match is None:
+            await send_cmd_help(ctx)
+            return
+        cases = self.case_store.for_user(server.id, match.group(1))
+        if not cases:
+            await self.bot.say("That user has no cases in this server.")
+            return
+        msg = ""
+        for case in cases:
+            action = ACTIONS_REPR.get(case["action"], (case["action"],))[0]
+            msg += "#{} {} - {}\n".format(case["case"], action,
+                                         case["reason"] or "No reason given")
+        for page in pagify(msg, shorten_by=16):
+            await self.bot.say(box(page))
+
     @commands.group(pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_channels=True)
     async def ignore(self, ctx):
@@ -1058,15 +1187,15 @@ class Mod:
         current_ch = ctx.message.channel
         if not channel:
             if current_ch.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.ignore_list["CHANNELS"].add(current_ch.id)
+                self.save_ignore_list()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
         else:
             if channel.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.ignore_list["CHANNELS"].add(channel.id)
+                self.save_ignore_list()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -1076,8 +1205,8 @@ class Mod:
         """Ignores current server"""
         server = ctx.message.server
         if server.id not in self.ignore_list["SERVERS"]:
-            self.ignore_list["SERVERS"].append(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self.ignore_list["SERVERS"].add(server.id)
+            self.save_ignore_list()
             await self.bot.say("This server has been added to the ignore list.")
         else:
             await self.bot.say("This server is already being ignored.")
@@ -1099,14 +1228,14 @@ class Mod:
         if not channel:
             if current_ch.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.save_ignore_list()
                 await self.bot.say("This channel has been removed from the ignore list.")
             else:
                 await self.bot.say("This channel is not in the ignore list.")
         else:
             if channel.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.save_ignore_list()
                 await self.bot.say("Channel removed from ignore list.")
             else:
                 await self.bot.say("That channel is not in the ignore list.")
@@ -1117,11 +1246,14 @@ class Mod:
         server = ctx.message.server
         if server.id in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].remove(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self.save_ignore_list()
             await self.bot.say("This server has been removed from the ignore list.")
         else:
             await self.bot.say("This server is not in the ignore list.")
 
+    def save_ignore_list(self):
+        save_id_sets("data/mod/ignorelist.json", self.ignore_list)
+
     def count_ignored(self):
         msg = "```Currently ignoring:\n"
         msg += str(len(self.ignore_list["CHANNELS"])) + " channels\n"
@@ -1170,6 +1302,8 @@ class Mod:
                 self.filter[server.id].append(w.lower())
                 added += 1
         if added:
+            self.filter_patterns.pop(server.id, None)
+            self.rule_plans.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words added to filter.")
         else:
@@ -1196,6 +1330,8 @@ class Mod:
                 self.filter[server.id].remove(w.lower())
                 removed += 1
         if removed:
+            self.filter_patterns.pop(server.id, None)
+            self.rule_plans.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words removed from filter.")
         else:
@@ -1267,12 +1403,12 @@ class Mod:
         msg = ""
         if names:
             names = [escape_mass_mentions(name) for name in names]
-            msg += "**Past 20 names**:\n"
+            msg += "**Past {} names**:\n".format(NAME_HISTORY_LENGTH)
             msg += ", ".join(names)
         if nicks:
             if msg:
                 msg += "\n\n"
-            msg += "**Past 20 nicknames**:\n"
+            msg += "**Past {} nicknames**:\n".format(NAME_HISTORY_LENGTH)
             msg += ", ".join(nicks)
         if msg:
             await self.bot.say(msg)
@@ -1280,20 +1416,63 @@ class Mod:
             await self.bot.say("That user doesn't have any recorded name or "
                                "nickname change.")
 
+    @commands.command()
+    @checks.is_owner()
+    async def modstats(self):
+        """Shows how much time the message rules take"""
+        if not self.rule_stats:
+            await self.bot.say("No messages have been inspected yet.")
+            return
+        msg = "{:<14}{:>10}{:>12}{:>10}{:>10}\n".format(
+            "Rule", "Checked", "Total (ms)", "Avg (us)", "Acted")
+        for name, (count, spent, acted) in sorted(self.rule_stats.items()):
+            msg += "{:<14}{:>10}{:>12.1f}{:>10.1f}{:>10}\n".format(
+                name, count, spent * 1000, spent / count * 1000000, acted)
+        await self.bot.say(box(msg))
+
+    async def stream_cleanup(self, channel, check, number, *, before=None,
+                             after=None, include=(), bulk=True):
+        """Deletes up to `number` messages matching check while the
+        channel's history is still being read
+
+        Messages in `include` are deleted as well. With bulk, messages
+        young enough for the purge endpoint go through it, 100 at a time,
+        older ones are deleted one by one. Returns how many were deleted."""
+        start = time.monotonic()
+        history = self.bot.logs_from(channel, limit=CLEANUP_SCAN_LIMIT,
+                                     before=before, after=after)
+        scanned, deleted = await stream_deletions(
+            history, check, number, loop=self.bot.loop, include=include,
+            purge=self.mass_purge, delete=self._delete_one,
+            bulk_deletable=self.is_bulk_deletable if bulk else None,
+            progress=partial(self._cleanup_progress, channel))
+
+        elapsed = time.monotonic() - start
+        logger.info("Cleanup in channel {}: scanned {}, deleted {} in {:.1f}s"
+                    " ({:.1f} messages/s)".format(
+                        channel.id, scanned, deleted,
+                        elapsed, deleted / elapsed if elapsed else 0))
+        return deleted
+
+    def _cleanup_progress(self, channel, total, deleted):
+        if (total - deleted) // 1000 != total // 1000:
+            logger.info("Cleanup in channel {}: {} messages deleted so far"
+                        "".format(channel.id, total))
+
+    async def _delete_one(self, message):
+        await self.slow_deletion([message])
+
+    def is_bulk_deletable(self, message):
+        """The purge endpoint refuses messages older than 14 days"""
+        return datetime.utcnow() - message.timestamp < BULK_DELETE_MAX_AGE
+
     async def mass_purge(self, messages):
-        while messages:
-            if len(messages) > 1:
-                await self.bot.delete_messages(messages[:100])
-                messages = messages[100:]
-            else:
-                await self.bot.delete_message(messages[0])
-                messages = []
-            await asyncio.sleep(1.5)
+        await self.bot.deletion_scheduler.delete_many(messages)
 
     async def slow_deletion(self, messages):
         for message in messages:
             try:
-                await self.bot.delete_message(message)
+                await self.bot.deletion_scheduler.delete(message)
             except:
                 pass
 
@@ -1307,18 +1486,13 @@ class Mod:
         else:
             raise TypeError('Only messages, members or roles may be passed')
 
-        server = obj.server
-        admin_role = settings.get_server_admin(server)
-
         if isinstance(obj, discord.Role):
-            return obj.name == admin_role
+            return obj.name == settings.get_server_admin(obj.server)
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        else:
-            return False
+        is_admin, _ = self.bot.is_admin_or_mod(user)
+        return is_admin
 
     def is_mod_or_superior(self, obj):
         if isinstance(obj, discord.Message):
@@ -1330,21 +1504,14 @@ class Mod:
         else:
             raise TypeError('Only messages, members or roles may be passed')
 
-        server = obj.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-
         if isinstance(obj, discord.Role):
-            return obj.name in [admin_role, mod_role]
+            server = obj.server
+            return obj.name in [settings.get_server_admin(server),
+                                settings.get_server_mod(server)]
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        return any(self.bot.is_admin_or_mod(user))
 
     def is_allowed_by_hierarchy(self, server, mod, user):
         toggled = self.settings[server.id].get("respect_hierarchy",
@@ -1367,10 +1534,7 @@ class Mod:
         if mod_channel is None:
             return None
 
-        if server.id not in self.cases:
-            self.cases[server.id] = {}
-
-        case_n = len(self.cases[server.id]) + 1
+        case_n = self.case_store.count(server.id) + 1
 
         case = {
             "case"         : case_n,
@@ -1397,12 +1561,7 @@ class Mod:
         except:
             pass
 
-        self.cases[server.id][str(case_n)] = case
-
-        if mod:
-            self.last_case[server.id][mod.id] = case_n
-
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.case_store.save(server.id, case)
 
         return case_n
 
@@ -1412,8 +1571,7 @@ class Mod:
         if channel is None:
             raise NoModLogChannel()
 
-        case = str(case)
-        case = self.cases[server.id][case]
+        case = self.case_store.get(server.id, case)
 
         if case["moderator_id"] is not None:
             if case["moderator_id"] != mod.id:
@@ -1435,7 +1593,7 @@ class Mod:
 
         case_msg = self.format_case_msg(case)
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.case_store.save(server.id, case)
 
         if case["message"] is None:  # The case's message was never sent
             raise CaseMessageNotFound()
@@ -1497,67 +1655,114 @@ class Mod:
 
         return case_msg
 
-    async def check_filter(self, message):
-        server = message.server
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    try:
-                        await self.bot.delete_message(message)
-                        logger.info("Message deleted in server {}."
-                                    "Filtered: {}"
-                                    "".format(server.id, w))
-                        return True
-                    except:
-                        pass
+    def get_filter_pattern(self, server):
+        """Returns the server's compiled filter, rebuilt after changes"""
+        try:
+            return self.filter_patterns[server.id]
+        except KeyError:
+            pattern = build_filter_pattern(self.filter.get(server.id))
+            self.filter_patterns[server.id] = pattern
+            return pattern
+
+    def get_rule_plan(self, server):
+        """Returns the (name, inspect, enforce) rules enabled on a server
+
+        Plans are cached and dropped whenever a rule's setting changes."""
+        try:
+            return self.rule_plans[server.id]
+        except KeyError:
+            pass
+        plan = []
+        if self.get_filter_pattern(server) is not None:
+            plan.append(("filter", self.inspect_filter, self.enforce_filter))
+        if server.id in self.settings:
+            server_settings = self.settings[server.id]
+            if server_settings["delete_repeats"]:
+                plan.append(("repeats", self.inspect_duplicates,
+                             self.enforce_duplicates))
+            if (server_settings["ban_mention_spam"] or
+                    server_settings.get("ban_mention_rate")):
+                plan.append(("mention_spam", self.inspect_mention_spam,
+                             self.enforce_mention_spam))
+        plan = tuple(plan)
+        self.rule_plans[server.id] = plan
+        return plan
+
+    async def run_rules(self, message, plan):
+        """Runs rules over a single normalized view of the message
+
+        Stops at the first rule that deals with the message."""
+        view = MessageView(message)
+        for name, inspect, enforce in plan:
+            start = time.perf_counter()
+            hit = inspect(view)
+            stats = self.rule_stats[name]
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+            if hit and await enforce(view, hit):
+                stats[2] += 1
+                return True
         return False
 
-    async def check_duplicates(self, message):
-        server = message.server
-        author = message.author
-        if server.id not in self.settings:
+    def inspect_filter(self, view):
+        match = self.get_filter_pattern(view.server).search(view.lowered)
+        return match.group() if match else None
+
+    async def enforce_filter(self, view, term):
+        try:
+            await self.bot.deletion_scheduler.delete(view.message)
+            logger.info("Message deleted in server {}."
+                        "Filtered: {}"
+                        "".format(view.server.id, term))
+            return True
+        except:
             return False
-        if self.settings[server.id]["delete_repeats"]:
-            if not message.content:
-                return False
-            if author.id not in self.cache:
-                self.cache[author.id] = deque(maxlen=3)
-            self.cache.move_to_end(author.id)
-            while len(self.cache) > 100000:
-                self.cache.popitem(last=False) # the oldest gets discarded
-            self.cache[author.id].append(message.content)
-            msgs = self.cache[author.id]
-            if len(msgs) == 3 and msgs[0] == msgs[1] == msgs[2]:
-                try:
-                    await self.bot.delete_message(message)
-                    return True
-                except:
-                    pass
-        return False
 
-    async def check_mention_spam(self, message):
-        server = message.server
-        author = message.author
-        if server.id not in self.settings:
+    def inspect_duplicates(self, view):
+        if not view.content:
+            return False
+        count = self.repeats.add(view.server.id, view.author.id, view.content)
+        return count >= 3
+
+    async def enforce_duplicates(self, view, _):
+        try:
+            await self.bot.deletion_scheduler.delete(view.message)
+            return True
+        except:
             return False
-        if self.settings[server.id]["ban_mention_spam"]:
-            max_mentions = self.settings[server.id]["ban_mention_spam"]
-            mentions = set(message.mentions)
-            if len(mentions) >= max_mentions:
-                try:
-                    self.temp_cache.add(author, server, "BAN")
-                    await self.bot.ban(author, 1)
-                except:
-                    logger.info("Failed to ban member for mention spam in "
-                                "server {}".format(server.id))
-                else:
-                    await self.new_case(server,
-                                        action="BAN",
-                                        mod=server.me,
-                                        user=author,
-                                        reason="Mention spam (Autoban)")
-                    return True
-        return False
+
+    def inspect_mention_spam(self, view):
+        mentions = view.mentions
+        if not mentions:
+            return False
+        server_settings = self.settings[view.server.id]
+        max_mentions = server_settings["ban_mention_spam"]
+        rate = server_settings.get("ban_mention_rate")
+        is_spam = bool(max_mentions) and mentions >= max_mentions
+        if rate:
+            max_rate, seconds = rate
+            total = self.mention_rates.add(view.server.id, view.author.id,
+                                           mentions, seconds)
+            is_spam = is_spam or total >= max_rate
+        return is_spam
+
+    async def enforce_mention_spam(self, view, _):
+        server = view.server
+        author = view.author
+        try:
+            self.temp_cache.add(author, server, "BAN")
+            await self.bot.ban(author, 1)
+        except:
+            logger.info("Failed to ban member for mention spam in "
+                        "server {}".format(server.id))
+            return False
+        else:
+            await self.new_case(server,
+                                action="BAN",
+                                mod=server.me,
+                                user=author,
+                                reason="Mention spam (Autoban)")
+            return True
 
     async def on_command(self, command, ctx):
         """Currently used for:
@@ -1578,7 +1783,7 @@ class Mod:
 
         async def _delete_helper(bot, message):
             try:
-                await bot.delete_message(message)
+                await bot.deletion_scheduler.delete(message)
                 logger.debug("Deleted command msg {}".format(message.id))
             except:
                 pass  # We don't really care if it fails or not
@@ -1594,14 +1799,14 @@ class Mod:
         valid_user = isinstance(author, discord.Member) and not author.bot
 
         #  Bots and mods or superior are ignored from the filter
-        if not valid_user or self.is_mod_or_superior(message):
+        if not valid_user:
+            return
+
+        plan = self.get_rule_plan(message.server)
+        if not plan or self.is_mod_or_superior(message):
             return
 
-        deleted = await self.check_filter(message)
-        if not deleted:
-            deleted = await self.check_duplicates(message)
-        if not deleted:
-            deleted = await self.check_mention_spam(message)
+        await self.run_rules(message, plan)
 
     async def on_message_edit(self, _, message):
         author = message.author
@@ -1610,10 +1815,17 @@ class Mod:
 
         valid_user = isinstance(author, discord.Member) and not author.bot
 
-        if not valid_user or self.is_mod_or_superior(message):
+        if not valid_user:
             return
 
-        await self.check_filter(message)
+        # Only the filter applies to edits
+        plan = self.get_rule_plan(message.server)[:1]
+        if not plan or plan[0][0] != "filter":
+            return
+        if self.is_mod_or_superior(message):
+            return
+
+        await self.run_rules(message, plan)
 
     async def on_member_ban(self, member):
         server = member.server
@@ -1630,29 +1842,64 @@ class Mod:
 
     async def check_names(self, before, after):
         if before.name != after.name:
-            if before.id not in self.past_names:
+            names = self.past_names.get(before.id)
+            if names is None:
                 self.past_names[before.id] = [after.name]
-            else:
-                if after.name not in self.past_names[before.id]:
-                    names = deque(self.past_names[before.id], maxlen=20)
-                    names.append(after.name)
-                    self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+                self._name_changed(names=True)
+            elif after.name not in names:
+                names.append(after.name)
+                del names[:-NAME_HISTORY_LENGTH]
+                self._name_changed(names=True)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if server.id not in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
-            else:
-                nicks = []
+            server_nicks = self.past_nicknames.setdefault(server.id, {})
+            nicks = server_nicks.setdefault(before.id, [])
             if after.nick not in nicks:
                 nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                del nicks[:-NAME_HISTORY_LENGTH]
+                self._name_changed(nicknames=True)
+
+    def _name_changed(self, *, names=False, nicknames=False):
+        self.names_dirty |= names
+        self.nicknames_dirty |= nicknames
+        self.pending_name_changes += 1
+        if self.pending_name_changes >= NAME_FLUSH_THRESHOLD:
+            self.flush_names()
+
+    def flush_names(self):
+        """Writes buffered name and nickname changes, if any"""
+        if self.names_dirty:
+            dataIO.save_json("data/mod/past_names.json", self.past_names)
+            self.names_dirty = False
+        if self.nicknames_dirty:
+            dataIO.save_json("data/mod/past_nicknames.json",
+                             self.past_nicknames)
+            self.nicknames_dirty = False
+        self.pending_name_changes = 0
+
+    async def name_flusher(self):
+        while self == self.bot.get_cog("Mod"):
+            await asyncio.sleep(NAME_FLUSH_INTERVAL)
+            self.flush_names()
+
+    async def apply_overwrites(self, edits):
+        """Runs (channel, edit) pairs concurrently with rate limit backoff
+
+        Returns the ids of the channels edited and of those that failed."""
+        results = await gather_with_backoff([edit for _, edit in edits],
+                                            limit=OVERWRITE_CONCURRENCY,
+                                            loop=self.bot.loop)
+        done, failed = [], []
+        for (channel, _), result in zip(edits, results):
+            if isinstance(result, Exception):
+                if not isinstance(result, discord.Forbidden):
+                    logger.info("Couldn't edit overwrites in channel {}: {}"
+                                "".format(channel.id, result))
+                failed.append(channel.id)
+            else:
+                done.append(channel.id)
+        return done, failed
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1725,4 +1972,5 @@ def setup(bot):
         logger.addHandler(handler)
     n = Mod(bot)
     bot.add_listener(n.check_names, "on_member_update")
+    bot.loop.create_task(n.name_flusher())
     bot.add_cog(n)
@@ -1,15 +1,15 @@
-import dateutil.parser
-import datetime
-import requests
+import aiohttp
 import asyncio
 import logging
-from bs4 import BeautifulSoup
+import time
+import os
 # import scrapy
 # from scrapy.crawler import CrawlerProcess
 import discord
 from discord.ext import commands
 from cogs.utils import checks
-from cogs.utils.dataIO import fileIO
+from cogs.utils.dataIO import dataIO, JsonJournal
+from cogs.utils.forum import parse_news_date, ListingLoader, MAX_CONCURRENT_FETCHES
 from __main__ import send_cmd_help
 
 log = logging.getLogger("red.news")
@@ -19,7 +19,105 @@ global_official_news_url = 'http://forums.maplestory2.nexon.net/categories/offic
 global_events_news_url = 'http://forums.maplestory2.nexon.net/categories/contests-and-events'
 blogs_news_url = 'http://forums.maplestory2.nexon.net/categories/maple-2-team-blogs'
 
-blog_database_path = 'data/news/blogs.json'
+#   categories the background poller can deliver
+news_categories = {
+    'official': global_official_news_url,
+    'blogs': blogs_news_url,
+    'events': global_events_news_url
+}
+
+settings_path = 'data/news/settings.json'
+subscriptions_path = 'data/news/subscriptions.json'
+deliveries_path = 'data/news/deliveries.json'
+
+#   pre-store per category lists, imported once into deliveries.json
+legacy_database_paths = {
+    'official': 'data/news/official.json',
+    'blogs': 'data/news/blogs.json',
+    'events': 'data/news/events.json'
+}
+default_settings = {"CACHE_TTL": 60, "POLL_INTERVAL": 300}
+
+#   channels notified at once when the poller fans out new items
+FANOUT_BATCH_SIZE = 10
+FANOUT_BATCH_DELAY = 1
+
+
+class NewsCache:
+    """Parsed forum listings keyed by category url
+
+    Every channel checking the same category within the TTL is served
+    from one fetch. Loads that overlap in time share a single request."""
+
+    def __init__(self, loader, ttl, loop):
+        self.loader = loader
+        self.ttl = ttl
+        self.loop = loop
+        self.entries = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    async def get(self, url):
+        entry = self.entries.get(url)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        task = self.pending.get(url)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.misses += 1
+            task = self.loop.create_task(self._load(url))
+            self.pending[url] = task
+            task.add_done_callback(lambda t: self.pending.pop(url, None))
+        #   shield so one cancelled caller doesn't cancel the others
+        return await asyncio.shield(task, loop=self.loop)
+
+    async def _load(self, url):
+        items = await self.loader(url)
+        #   failed fetches aren't cached so the next check retries
+        if items is not None:
+            self.entries[url] = (time.monotonic() + self.ttl, items)
+        return items
+
+    def invalidate(self, url=None):
+        if url is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(url, None)
+
+
+class DeliveryStore:
+    """Last delivered news id per (category, server, channel)
+
+    Lookups and updates are dict operations; each delivery appends a
+    single record to a journal that is compacted every so often."""
+
+    def __init__(self, filename):
+        self.journal = JsonJournal(filename)
+        self.state = self.journal.load(self._apply, default={})
+
+    @staticmethod
+    def _apply(state, record):
+        servers = state.setdefault(record['category'], {})
+        servers.setdefault(record['server'], {})[record['channel']] = record['id']
+
+    def last_delivered(self, category, server_id, channel_id):
+        return self.state.get(category, {}).get(server_id, {}).get(channel_id)
+
+    def mark_delivered(self, category, server_id, channel_id, news_id):
+        record = {'category': category, 'server': server_id,
+                  'channel': channel_id, 'id': news_id}
+        self._apply(self.state, record)
+        if self.journal.append(record):
+            self.journal.compact(self.state)
+
+    def close(self):
+        self.journal.compact(self.state)
+
 
 class News:
     """MapleStory 2 bot"""
@@ -27,7 +125,6 @@ class News:
     global global_official_news_url
     global global_events_news_url
     global blogs_news_url
-    global blog_database_path
 
     @commands.group(pass_context=True, name="news")
     async def news(self, ctx):
@@ -41,6 +138,83 @@ class News:
             # await self.bot.say(ctx.message.author.mention)
             await send_cmd_help(ctx)
 
+    @news.command(name="cache")
+    @checks.is_owner()
+    async def cache_stats(self):
+        """Shows news cache statistics"""
+        cache = self.cache
+        msg = ("Cached categories: {}\nTTL: {}s\nHits: {}\nMisses: {}\n"
+               "Shared in-flight: {}\nPages parsed: {}"
+               "".format(len(cache.entries), cache.ttl, cache.hits,
+                         cache.misses, cache.shared, self.forum.parses))
+        await self.bot.say(msg)
+
+    @news.command(name="cachettl")
+    @checks.is_owner()
+    async def cache_ttl(self, seconds: int):
+        """Sets how long parsed news pages are reused, in seconds"""
+        if seconds < 0:
+            await self.bot.say("The TTL can't be negative.")
+            return
+        self.settings["CACHE_TTL"] = seconds
+        dataIO.save_json(settings_path, self.settings)
+        self.cache.ttl = seconds
+        self.cache.invalidate()
+        await self.bot.say("News pages will be cached for {} seconds."
+                           "".format(seconds))
+
+    @news.command(name="subscribe", pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def subscribe(self, ctx, category: str):
+        """Adds/removes automatic news posts in the current channel
+
+        Categories: official, blogs, events"""
+        category = category.lower()
+        if category not in news_categories:
+            await send_cmd_help(ctx)
+            return
+
+        channel = ctx.message.channel
+        subscription = self.subscriptions.setdefault(
+            category, {"LAST_ID": None, "CHANNELS": {}})
+        channels = subscription["CHANNELS"]
+
+        if channel.id in channels:
+            del channels[channel.id]
+            await self.bot.say("This channel will no longer receive {} news."
+                               "".format(category))
+        else:
+            channels[channel.id] = channel.server.id
+            await self.bot.say("New {} news will be posted in this channel."
+                               "".format(category))
+
+        dataIO.save_json(subscriptions_path, self.subscriptions)
+
+    @news.command(name="subscriptions", pass_context=True, no_pm=True)
+    async def list_subscriptions(self, ctx):
+        """Lists the news categories posted in the current channel"""
+        channel = ctx.message.channel
+        categories = [category for category, sub in
+                      sorted(self.subscriptions.items())
+                      if channel.id in sub["CHANNELS"]]
+        if categories:
+            await self.bot.say("This channel receives: {}"
+                               "".format(", ".join(categories)))
+        else:
+            await self.bot.say("This channel isn't subscribed to any news.")
+
+    @news.command(name="pollinterval")
+    @checks.is_owner()
+    async def poll_interval(self, seconds: int):
+        """Sets how often subscribed news categories are checked"""
+        if seconds < 30:
+            await self.bot.say("The interval must be at least 30 seconds.")
+            return
+        self.settings["POLL_INTERVAL"] = seconds
+        dataIO.save_json(settings_path, self.settings)
+        await self.bot.say("News will be checked every {} seconds."
+                           "".format(seconds))
+
     @news.command(name="official", pass_context=True)
     async def latest_official_news(self, ctx):
         """Get the latest news!"""
@@ -48,23 +222,16 @@ class News:
         #   Add "typing... " status
         await self.bot.send_typing(ctx.message.channel)
 
-        #   if status code is successful...
-        response = requests.get(global_official_news_url)
-        if response.status_code == 200:
-            log.info('Page request success')
-
-            news = self._get_news(global_official_news_url)
+        #   if the news was fetched successfully...
+        news = await self.cache.get(global_official_news_url)
+        if news:
             latest_official_news = self._get_latest_news(news)
 
             #message = self.bot.guilds.get("433766043098415127").channels.get(435539078637682688);
             # message = self.bot.server
             # print(message)
             #   msg builder
-            msg = '{:%B %d, %Y}'.format(dateutil.parser.parse(latest_official_news['date_created']))
-            msg += "\n"
-            msg += latest_official_news['title']
-            msg += "\n"
-            msg += latest_official_news['link']
+            msg = self._format_news(latest_official_news)
 
             log.info('News has been posted.')
             await self.bot.say(msg)
@@ -72,190 +239,55 @@ class News:
             log.info('Page request failed.')
             await self.bot.say("Sorry! I can't seem to get any news right now.")    
 
-    @news.command(name="check_official", pass_context=True)
+    @news.command(name="check_official", pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def check_latest_official(self, ctx):
         """Check the latest official news"""
-        #   if status code is successful...
-        response = requests.get(global_official_news_url)
-        if response.status_code == 200:
-            log.info('Page request success')
-
-            news = self._get_news(response)
-            latest_official_news = self._get_latest_news(news)
+        await self._check_latest(ctx, 'official')
 
-            # variables
-            channel = ctx.message.channel
-            server = ctx.message.server
-
-            #   check if messsage exists in the data
-            is_news_posted_already = False
-            latest_official_news_in_database = fileIO('data/news/official.json', 'load')
-            for item in latest_official_news_in_database:
-                #   if there exists a server id and channel id in the database...
-                if item['server_id'] == server.id and item['channel_id'] == channel.id:
-                    #   if the database id matches the latest checked news id...
-                    if item['latest_news']['id'] == latest_official_news['id']:
-                        is_news_posted_already = True
-
-            #   if there was the sames news already in the database, do nothing
-            if is_news_posted_already == True:
-                log.info('Official news has already been posted in channel "{}" in server "{}"! Doing nothing.'.format(channel.name, server.name))
-                return
-            #   else the latest news has not been posted yet...
-            else:
-                #   Delete previous posted news?
-
-
-                #   create and save new news to database
-                new_news = {
-                    'server_name': server.name,
-                    'server_id': server.id,
-                    'channel_id': channel.id,
-                    'channel_name': channel.name,
-                    'latest_news': latest_official_news
-                }
-                latest_official_news_in_database.append(new_news)
-                fileIO('data/news/official.json', 'save', latest_official_news_in_database)
-                log.info('New news has been added to database.')
-
-
-                #   Add "typing... " status
-                await self.bot.send_typing(ctx.message.channel)
-
-                #   msg builder
-                msg = '{:%B %d, %Y}'.format(dateutil.parser.parse(latest_official_news['date_created']))
-                msg += "\n"
-                msg += latest_official_news['title']
-                msg += "\n"
-                msg += latest_official_news['link']
-
-                log.info('New official news has been posted in channel "{}" in server "{}".'.format(
-                    channel.name, server.name))
-                await self.bot.say(msg)
-                return
-    
-    @news.command(name="check_blogs", pass_context=True)
+    @news.command(name="check_blogs", pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def check_latest_blogs(self, ctx):
         """Check the latest blogs news"""
-        #   if status code is successful...
-        response = requests.get(blogs_news_url)
-        if response.status_code == 200:
-            log.info('Page request success')
-
-            news = self._get_news(response)
-            latest_news = self._get_latest_news(news)
-
-            # variables
-            channel = ctx.message.channel
-            server = ctx.message.server
-
-            #   check if messsage exists in the data
-            is_news_posted_already = False
-            latest_news_in_database = fileIO(blog_database_path, 'load')
-            for item in latest_news_in_database:
-                #   if there exists a server id and channel id in the database...
-                if item['server_id'] == server.id and item['channel_id'] == channel.id:
-                    #   if the database id matches the latest checked news id...
-                    if item['latest_news']['id'] == latest_news['id']:
-                        is_news_posted_already = True
-
-            #   if there was the sames news already in the database, do nothing
-            if is_news_posted_already == True:
-                log.info('Blog news has already been posted in channel "{}" in server "{}"! Doing nothing.'.format(channel.name, server.name))
-                return
-            #   else the latest news has not been posted yet...
-            else:
-                #   Delete previous posted news?
-
-                #   create and save new news to database
-                new_news = {
-                    'server_name': server.name,
-                    'server_id': server.id,
-                    'channel_id': channel.id,
-                    'channel_name': channel.name,
-                    'latest_news': latest_news
-                }
-                latest_news_in_database.append(new_news)
-                fileIO(blog_database_path, 'save',
-                       latest_news_in_database)
-                log.info('New blog news has been added to database.')
-
-                #   Add "typing... " status
-                await self.bot.send_typing(ctx.message.channel)
-
-                #   msg builder
-                msg = '{:%B %d, %Y}'.format(dateutil.parser.parse(
-                    latest_news['date_created']))
-                msg += "\n"
-                msg += latest_news['title']
-                msg += "\n"
-                msg += latest_news['link']
-
-                log.info('New blog news has been posted in channel "{}" in server "{}".'.format(
-                    channel.name, server.name))
-                await self.bot.say(msg)
-                return
-
-    @news.command(name="check_events", pass_context=True)
+        await self._check_latest(ctx, 'blogs')
+
+    @news.command(name="check_events", pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def check_latest_events(self, ctx):
         """Check the latest event news"""
-        #   if status code is successful...
-        response = requests.get(global_events_news_url)
-        if response.status_code == 200:
-            log.info('Page request success')
-
-            news = self._get_news(response)
-            latest_event_news = self._get_latest_news(news)
-
-            # variables
-            channel = ctx.message.channel
-            server = ctx.message.server
-
-            #   check if messsage exists in the data
-            is_news_posted_already = False
-            latest_event_news_in_database = fileIO('data/news/events.json', 'load')
-            for item in latest_event_news_in_database:
-                #   if there exists a server id and channel id in the database...
-                if item['server_id'] == server.id and item['channel_id'] == channel.id:
-                    #   if the database id matches the latest checked news id...
-                    if item['latest_news']['id'] == latest_event_news['id']:
-                        is_news_posted_already = True
-
-            #   if there was the sames news already in the database, do nothing
-            if is_news_posted_already == True:
-                log.info('Event news has already been posted in channel "{}" in server "{}"! Doing nothing.'.format(channel.name, server.name))
-                return
-            #   else the latest news has not been posted yet...
-            else:
-                #   create and save new news to database
-                new_news = {
-                    'server_name': server.name,
-                    'server_id': server.id,
-                    'channel_id': channel.id,
-                    'channel_name': channel.name,
-                    'latest_news': latest_event_news
-                }
-                latest_event_news_in_database.append(new_news)
-                fileIO('data/news/events.json', 'save', latest_event_news_in_database)
-                log.info('New event news has been added to database.')
-
-
-                #   Add "typing... " status
-                await self.bot.send_typing(ctx.message.channel)
-
-                #   msg builder
-                msg = '{:%B %d, %Y}'.format(dateutil.parser.parse(latest_event_news['date_created']))
-                msg += "\n"
-                msg += latest_event_news['title']
-                msg += "\n"
-                msg += latest_event_news['link']
-
-                log.info('New event news has been posted in channel "{}" in server "{}".'.format(channel.name, server.name))
-                await self.bot.say(msg)
-                return
+        await self._check_latest(ctx, 'events')
+
+    async def _check_latest(self, ctx, category):
+        #   if the news was fetched successfully...
+        news = await self.cache.get(news_categories[category])
+        if not news:
+            return
+
+        latest_news = self._get_latest_news(news)
+
+        # variables
+        channel = ctx.message.channel
+        server = ctx.message.server
+
+        #   if the same news was already posted here, do nothing
+        last_id = self.deliveries.last_delivered(category, server.id, channel.id)
+        if last_id == latest_news['id']:
+            log.info('{} news has already been posted in channel "{}" in server "{}"! Doing nothing.'.format(
+                category.capitalize(), channel.name, server.name))
+            return
+
+        self.deliveries.mark_delivered(category, server.id, channel.id,
+                                       latest_news['id'])
+
+        #   Add "typing... " status
+        await self.bot.send_typing(channel)
+
+        #   msg builder
+        msg = self._format_news(latest_news)
+
+        log.info('New {} news has been posted in channel "{}" in server "{}".'.format(
+            category, channel.name, server.name))
+        await self.bot.say(msg)
 
     # @commands.command(pass_context=True)
     # async def load_news(self, data):
@@ -268,71 +300,184 @@ class News:
 
 
     '''
-        Returns the array of dictionary news after web extraction
+        Polls every subscribed category once per interval and fans new
+        items out to the subscribed channels
     '''
 
-    def _get_news(self, page):
-        items = []
-
-        #   initialize BS4 objs
-        soup = BeautifulSoup(page.content, 'html.parser')
-
-        # for row in soup.findAll('table')[0].tbody.findAll('tr'):
-        for row in soup.select('tr'):
-            #   Fetch and extract data
-            discussion_id = row.get('id')
-            title = row.find('a', attrs={'class': 'Title'})
-            link = row.find('a', attrs={'class': 'Title'})
-            date_created = row.find('time')
-            #   Skip any rows that lack a title
-            if discussion_id == None:
-                continue
-
-            #   Clean up data
-            title = title.text  # find text in title selector
-            # get the link within selector AND add 1st page parameter to link
-            link = link.get('href') + '/p1'
-            # Get the datetime within the selector and convert to datetime obj
-            #date_created = dateutil.parser.parse(date_created['datetime'])
-
-            #   Create dictionary item
-            item = {
-                'id': discussion_id,
-                'title': title,
-                'link': link,
-                'date_created': date_created['datetime']
-            }
-
-            #   append item to items list
-            items.append(item)
-
-        return items
+    async def news_poller(self):
+        #   channels can't be resolved before the bot has connected
+        await self.bot.wait_until_ready()
+        while self == self.bot.get_cog("News"):
+            save = False
+
+            for category, url in news_categories.items():
+                subscription = self.subscriptions.get(category)
+                if not subscription or not subscription["CHANNELS"]:
+                    continue
+                try:
+                    news = await self.cache.get(url)
+                    #   the same listing object means the page is unchanged
+                    if not news or news is self.last_polled.get(category):
+                        continue
+                    channels = self._get_channels(subscription)
+                    if not channels:
+                        #   keep the mark until there's somewhere to post
+                        continue
+                    self.last_polled[category] = news
+                    new_items = self._get_new_items(subscription, news)
+                    if new_items is None:
+                        continue
+                    save = True
+                    for item in new_items:
+                        await self._fan_out(category, channels, item)
+                except Exception as e:  # We don't want our task to die
+                    log.exception(e)
+
+            if save:
+                dataIO.save_json(subscriptions_path, self.subscriptions)
+
+            await asyncio.sleep(self.settings["POLL_INTERVAL"])
 
     '''
-        Returns the single latest news given a array of news dictionary   
+        Returns the items newer than the category's high-water mark,
+        oldest first, and advances the mark. None if nothing changed.
     '''
 
-    def _get_latest_news(self, news):
-        latest_news = news[0]
+    def _get_new_items(self, subscription, news):
+        latest = self._get_latest_news(news)
+        mark = subscription.get("LAST_DATE")
 
-        for item in news:
-            #   parse datetime string to datetime before comparing
-            item_date_created = dateutil.parser.parse(item['date_created'])
-            latest_news_date_created = dateutil.parser.parse(latest_news['date_created'])
+        if mark is None:
+            #   fresh install: don't repost the current item. Marks kept
+            #   before dates were tracked only know the latest id.
+            if subscription["LAST_ID"] in (None, latest['id']):
+                new_items = []
+            else:
+                new_items = [latest]
+        else:
+            mark = parse_news_date(mark)
+            new_items = sorted((item for item in news
+                                if item['date'] > mark and
+                                item['id'] != subscription["LAST_ID"]),
+                               key=lambda item: item['date'])
+            if not new_items:
+                return None
+
+        subscription["LAST_ID"] = latest['id']
+        subscription["LAST_DATE"] = latest['date'].isoformat()
+        return new_items
+
+    def _get_channels(self, subscription):
+        channels = (self.bot.get_channel(channel_id)
+                    for channel_id in subscription["CHANNELS"])
+        return [channel for channel in channels if channel is not None]
+
+    async def _fan_out(self, category, channels, item):
+        msg = self._format_news(item)
+
+        for i in range(0, len(channels), FANOUT_BATCH_SIZE):
+            batch = []
+            for channel in channels[i:i + FANOUT_BATCH_SIZE]:
+                can_speak = channel.permissions_for(channel.server.me).send_messages
+                if can_speak:
+                    batch.append(self.bot.send_message(channel, msg))
+            if batch:
+                await asyncio.gather(*batch, return_exceptions=True)
+                await asyncio.sleep(FANOUT_BATCH_DELAY)
+
+        log.info('Posted {} news "{}" to {} channels.'.format(
+            category, item['title'], len(channels)))
 
-            if item_date_created > latest_news_date_created:
-                latest_news = item
+    '''
+        Builds the chat message for a single news item
+    '''
 
-        return latest_news
+    def _format_news(self, item):
+        msg = '{:%B %d, %Y}'.format(item['date'])
+        msg += "\n"
+        msg += item['title']
+        msg += "\n"
+        msg += item['link']
+        return msg
+
+    '''
+        Returns the single latest news given a array of news dictionary   
+    '''
+
+    def _get_latest_news(self, news):
+        #   dates are parsed once during extraction; ties keep the first row
+        return max(news, key=lambda item: item['date'])
 
     def __init__(self, bot):
         #   change status
         self.bot = bot
+        #   one pooled keep-alive session shared by every news command
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_FETCHES,
+                                         loop=self.bot.loop)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             loop=self.bot.loop)
+        self.forum = ListingLoader(self.session, self.bot.loop)
+        self.last_polled = {}
+        self.settings = dataIO.load_json(settings_path)
+        self.subscriptions = dataIO.load_json(subscriptions_path)
+        self.deliveries = DeliveryStore(deliveries_path)
+        self.cache = NewsCache(self.forum.load, self.settings["CACHE_TTL"],
+                               self.bot.loop)
         #self.bot.change_presence(game=discord.Game(name='MapleStory 2'))
         log.info("News Initialized!")
-        
+
+    def __unload(self):
+        self.session.close()
+        self.deliveries.close()
+
+
+def check_folders():
+    if not os.path.exists("data/news"):
+        print("Creating data/news folder...")
+        os.makedirs("data/news")
+
+
+def check_files():
+    if not dataIO.is_valid_json(deliveries_path):
+        print("Creating {}...".format(deliveries_path))
+        dataIO.save_json(deliveries_path, migrate_legacy_databases())
+
+    if not dataIO.is_valid_json(subscriptions_path):
+        print("Creating empty {}...".format(subscriptions_path))
+        dataIO.save_json(subscriptions_path, {})
+
+    if not dataIO.is_valid_json(settings_path):
+        print("Creating default news settings.json...")
+        dataIO.save_json(settings_path, default_settings)
+    else:
+        current = dataIO.load_json(settings_path)
+        if current.keys() != default_settings.keys():
+            for key in default_settings.keys():
+                if key not in current.keys():
+                    current[key] = default_settings[key]
+            dataIO.save_json(settings_path, current)
+
+
+def migrate_legacy_databases():
+    #   the old lists appended a record per post; the last one wins
+    state = {}
+    for category, path in legacy_database_paths.items():
+        if not dataIO.is_valid_json(path):
+            continue
+        print("Importing {}...".format(path))
+        for item in dataIO.load_json(path):
+            servers = state.setdefault(category, {})
+            channels = servers.setdefault(item['server_id'], {})
+            channels[item['channel_id']] = item['latest_news']['id']
+    return state
+
+
 '''
     setup
 '''
 def setup(bot):
-    bot.add_cog(News(bot))
+    check_folders()
+    check_files()
+    n = News(bot)
+    bot.loop.create_task(n.news_poller())
+    bot.add_cog(n)
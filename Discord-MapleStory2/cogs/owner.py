@@ -4,6 +4,7 @@ from cogs.utils import checks
 from cogs.utils.converters import GlobalUser
 from __main__ import set_cog
 from .utils.dataIO import dataIO
+from .utils.idsets import load_id_sets, save_id_sets
 from .utils.chat_formatting import pagify, box
 
 import importlib
@@ -46,7 +47,7 @@ class Owner:
         self.bot = bot
         self.setowner_lock = False
         self.disabled_commands = dataIO.load_json("data/red/disabled_commands.json")
-        self.global_ignores = dataIO.load_json("data/red/global_ignores.json")
+        self.global_ignores = load_id_sets("data/red/global_ignores.json")
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
 
     def __unload(self):
@@ -539,7 +540,7 @@ class Owner:
     async def _blacklist_add(self, user: GlobalUser):
         """Adds user to Red's global blacklist"""
         if user.id not in self.global_ignores["blacklist"]:
-            self.global_ignores["blacklist"].append(user.id)
+            self.global_ignores["blacklist"].add(user.id)
             self.save_global_ignores()
             await self.bot.say("User has been blacklisted.")
         else:
@@ -569,7 +570,7 @@ class Owner:
     @blacklist.command(name="clear")
     async def _blacklist_clear(self):
         """Clears the global blacklist"""
-        self.global_ignores["blacklist"] = []
+        self.global_ignores["blacklist"] = set()
         self.save_global_ignores()
         await self.bot.say("Blacklist is now empty.")
 
@@ -591,7 +592,7 @@ class Owner:
                 msg = "\nNon-whitelisted users will be ignored."
             else:
                 msg = ""
-            self.global_ignores["whitelist"].append(user.id)
+            self.global_ignores["whitelist"].add(user.id)
             self.save_global_ignores()
             await self.bot.say("User has been whitelisted." + msg)
         else:
@@ -621,7 +622,7 @@ class Owner:
     @whitelist.command(name="clear")
     async def _whitelist_clear(self):
         """Clears the global whitelist"""
-        self.global_ignores["whitelist"] = []
+        self.global_ignores["whitelist"] = set()
         self.save_global_ignores()
         await self.bot.say("Whitelist is now empty.")
 
@@ -1052,7 +1053,7 @@ class Owner:
         return fmt.format(d=days, h=hours, m=minutes, s=seconds)
 
     def save_global_ignores(self):
-        dataIO.save_json("data/red/global_ignores.json", self.global_ignores)
+        save_id_sets("data/red/global_ignores.json", self.global_ignores)
 
     def save_disabled_commands(self):
         dataIO.save_json("data/red/disabled_commands.json", self.disabled_commands)
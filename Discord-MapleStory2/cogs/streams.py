@@ -623,7 +623,7 @@ class Streams:
             is_enabled = settings.get("AUTODELETE", True)
             try:
                 if is_enabled:
-                    await self.bot.delete_message(message)
+                    await self.bot.deletion_scheduler.delete(message)
             except:
                 pass
 
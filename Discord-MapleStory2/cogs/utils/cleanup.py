@@ -0,0 +1,74 @@
+"""Streamed message cleanup for the mod cog"""
+import asyncio
+
+
+# Messages buffered between reading history and deleting
+QUEUE_SIZE = 500
+
+
+async def stream_deletions(history, check, number, *, purge, delete, loop,
+                           include=(), bulk_deletable=None, progress=None):
+    """Deletes up to `number` messages of history matching check while
+    the history is still being read
+
+    history is an async iterator of messages, only read when number is
+    positive. Messages in `include` are deleted as well. Those for which
+    bulk_deletable returns True are handed to purge 100 at a time, the
+    others to delete one by one. progress, if given, is called with the
+    running total and the count just deleted. Returns how many messages
+    were scanned and deleted."""
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE, loop=loop)
+    stats = {"scanned": 0, "deleted": 0}
+
+    async def produce():
+        try:
+            for message in include:
+                await queue.put(message)
+            matched = 0
+            if number > 0:
+                async for message in history:
+                    stats["scanned"] += 1
+                    if check(message):
+                        await queue.put(message)
+                        matched += 1
+                        if matched >= number:
+                            break
+        except asyncio.CancelledError:
+            raise  # The consumer failed, nobody is left to wake up
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    def deleted(count):
+        stats["deleted"] += count
+        if progress is not None:
+            progress(stats["deleted"], count)
+
+    async def consume():
+        batch = []
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            if bulk_deletable is not None and bulk_deletable(message):
+                batch.append(message)
+                if len(batch) == 100:
+                    await purge(batch)
+                    deleted(len(batch))
+                    batch = []
+            else:
+                await delete(message)
+                deleted(1)
+        if batch:
+            await purge(batch)
+            deleted(len(batch))
+
+    producer = loop.create_task(produce())
+    try:
+        await consume()
+    finally:
+        # Otherwise a failed deletion leaves it blocked on a full queue
+        producer.cancel()
+    await producer
+    return stats["scanned"], stats["deleted"]
@@ -64,6 +64,113 @@ class DataIO():
             raise InvalidFileIO("FileIO was called with invalid"
                 " parameters")
 
+class JsonJournal():
+    """Json snapshot plus an append-only log of changes made since
+
+    Records must be idempotent upserts: compaction saves the snapshot
+    before truncating the log, so a crash in between replays records
+    the snapshot already contains."""
+
+    def __init__(self, filename, compact_every=1000):
+        self.logger = logging.getLogger("red")
+        self.filename = filename
+        self.log_filename = os.path.splitext(filename)[0] + ".log"
+        # Holds the records a background compaction is snapshotting
+        self.old_log_filename = self.log_filename + ".old"
+        self.compact_every = compact_every
+        self.compacting = False
+        self.pending = 0
+        self._log = None
+
+    def load(self, apply, default=None):
+        """Loads the snapshot and replays the log onto it with apply"""
+        if os.path.exists(self.filename):
+            data = dataIO.load_json(self.filename)
+        else:
+            data = default
+        for filename in (self.old_log_filename, self.log_filename):
+            try:
+                with open(filename, encoding='utf-8', mode="r") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # A torn last line from a crash mid-write
+                            self.logger.warning("Skipping unreadable record "
+                                                "in {}".format(filename))
+                            continue
+                        apply(data, record)
+                        self.pending += 1
+            except FileNotFoundError:
+                pass
+        return data
+
+    def append(self, *records):
+        """Durably appends records, returns True when compaction is due"""
+        if self._log is None:
+            self._log = open(self.log_filename, encoding='utf-8', mode="a")
+        self._log.write("".join(json.dumps(r, separators=(',', ':')) + "\n"
+                                for r in records))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self.pending += len(records)
+        return self.pending >= self.compact_every
+
+    def compact(self, data):
+        """Saves data as the new snapshot and empties the log
+
+        Does nothing but close the log while compact_async is running:
+        its older snapshot would be saved over this one, so the log has
+        to stay for replay."""
+        if self.compacting:
+            self.close()
+            return False
+        if not dataIO.save_json(self.filename, data):
+            return False
+        self.close()
+        open(self.log_filename, encoding='utf-8', mode="w").close()
+        if os.path.exists(self.old_log_filename):
+            os.remove(self.old_log_filename)
+        self.pending = 0
+        return True
+
+    async def compact_async(self, data, loop):
+        """Snapshots a copy of data in an executor while new records
+        keep going to a fresh log"""
+        if self.compacting:
+            return False
+        self.compacting = True
+        try:
+            self.close()
+            self._rotate()
+            self.pending = 0
+            snapshot = json.loads(json.dumps(data))
+            saved = await loop.run_in_executor(None, dataIO.save_json,
+                                               self.filename, snapshot)
+            if saved and os.path.exists(self.old_log_filename):
+                os.remove(self.old_log_filename)
+            return saved
+        finally:
+            self.compacting = False
+
+    def _rotate(self):
+        if not os.path.exists(self.log_filename):
+            return
+        if not os.path.exists(self.old_log_filename):
+            os.replace(self.log_filename, self.old_log_filename)
+            return
+        # A previous compaction failed, keep its records too
+        with open(self.log_filename, encoding='utf-8', mode="r") as src, \
+                open(self.old_log_filename, encoding='utf-8', mode="a") as dst:
+            dst.write(src.read())
+        open(self.log_filename, encoding='utf-8', mode="w").close()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
 def get_value(filename, key):
     with open(filename, encoding='utf-8', mode="r") as f:
         data = json.load(f)
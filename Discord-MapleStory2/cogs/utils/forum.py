@@ -0,0 +1,205 @@
+"""Fetching and parsing of forum category listings for the news cog"""
+import asyncio
+import datetime
+import hashlib
+import logging
+from html.parser import HTMLParser
+
+import aiohttp
+import dateutil.parser
+
+log = logging.getLogger("red.news")
+
+#   Shared fetch settings for every news command
+FETCH_TIMEOUT = 15
+MAX_CONCURRENT_FETCHES = 4
+
+#   returned by ListingLoader.fetch when the forum answers 304
+NOT_MODIFIED = object()
+
+
+def parse_news_date(value):
+    """Returns a timezone-aware datetime for a <time datetime> value"""
+    #   fast path for the forum's ISO-8601 stamps, e.g.
+    #   2018-05-01T10:00:00+00:00 (strptime's %z wants +0000)
+    if value.endswith('Z'):
+        iso = value[:-1] + '+0000'
+    elif len(value) > 6 and value[-3] == ':' and value[-6] in '+-':
+        iso = value[:-3] + value[-2:]
+    else:
+        iso = value
+    try:
+        return datetime.datetime.strptime(iso, '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        pass
+
+    date = dateutil.parser.parse(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+class ForumListingParser(HTMLParser):
+    """Streams a forum category page, collecting one dict per discussion
+
+    Only the <tr id>, its first <a class="Title"> and first <time> are
+    looked at; no document tree is built. Every row is read: the forum
+    orders them by last activity, not by the date collected here, so
+    already delivered rows can sit above new ones."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items = []
+        self.row = None
+        self.title_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self.row = dict(attrs)
+            self.row.update(title=None, link=None, date=None, text=[])
+            self.title_depth = 0
+            return
+        row = self.row
+        if row is None:
+            return
+        #   the row's first <time> anywhere, the Title link included
+        if tag == 'time' and row['date'] is None:
+            row['date'] = dict(attrs).get('datetime')
+        if self.title_depth:
+            if tag == 'a':
+                self.title_depth += 1
+        elif tag == 'a' and row['link'] is None:
+            attrs = dict(attrs)
+            if 'Title' in (attrs.get('class') or '').split():
+                row['link'] = attrs.get('href') or ''
+                self.title_depth = 1
+
+    def handle_endtag(self, tag):
+        row = self.row
+        if row is None:
+            return
+        if tag == 'a' and self.title_depth:
+            self.title_depth -= 1
+            if not self.title_depth:
+                row['title'] = ''.join(row['text'])
+        elif tag == 'tr':
+            self.row = None
+            #   Skip any rows that lack an id, a title or a date
+            if row.get('id') is None or row['title'] is None or row['date'] is None:
+                return
+            try:
+                date = parse_news_date(row['date'])
+            except (ValueError, OverflowError):
+                return
+            self.items.append({
+                'id': row['id'],
+                'title': row['title'],
+                # add 1st page parameter to link
+                'link': row['link'] + '/p1',
+                'date_created': row['date'],
+                'date': date
+            })
+
+    def handle_data(self, data):
+        if self.title_depth:
+            self.row['text'].append(data)
+
+
+def get_listing_table(page):
+    """Returns only the discussion table html of a category page"""
+    if isinstance(page, bytes):
+        page = page.decode('utf-8', 'replace')
+
+    #   discussion rows only live inside the listing table, so skip
+    #   the header, sidebar and scripts around it
+    start = page.find('<table')
+    end = page.rfind('</table>')
+    if start != -1 and end != -1:
+        page = page[start:end + len('</table>')]
+    return page
+
+
+def parse_listing(table):
+    """Returns the discussion dicts of a listing table, see
+    ForumListingParser"""
+    parser = ForumListingParser()
+    parser.feed(table)
+    parser.close()
+    return parser.items
+
+
+class ListingLoader:
+    """Fetches and parses category listings
+
+    Pages are revalidated with the ETag/Last-Modified the forum sent,
+    and a page whose listing table hashes the same as last time isn't
+    parsed again. Either way the previously parsed list itself is
+    returned."""
+
+    def __init__(self, session, loop):
+        self.session = session
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES, loop=loop)
+        #   per url ETag/Last-Modified and (table hash, parsed listing)
+        self.validators = {}
+        self.listings = {}
+        self.parses = 0
+
+    async def load(self, url):
+        """Returns the url's listing, None if the request failed"""
+        page = await self.fetch(url)
+        if page is None:
+            return None
+        previous = self.listings.get(url)
+        if page is NOT_MODIFIED:
+            log.debug('{} not modified'.format(url))
+            return previous[1]
+        log.info('Page request success')
+
+        table = get_listing_table(page)
+        digest = hashlib.sha1(table.encode('utf-8')).hexdigest()
+        if previous is not None and previous[0] == digest:
+            log.debug('{} unchanged'.format(url))
+            return previous[1]
+
+        news = parse_listing(table)
+        self.parses += 1
+        self.listings[url] = (digest, news)
+        return news
+
+    async def fetch(self, url):
+        """Returns the raw page, NOT_MODIFIED, or None if the request
+        failed"""
+        #   Bound the number of forum requests in flight so a slow forum
+        #   can't pile up connections; the rest of the bot keeps running
+        #   while we wait on the network.
+        with await self.semaphore:
+            try:
+                return await asyncio.wait_for(self._request(url),
+                                              FETCH_TIMEOUT, loop=self.loop)
+            except asyncio.TimeoutError:
+                log.warning('Page request to {} timed out.'.format(url))
+            except aiohttp.ClientError as e:
+                log.warning('Page request to {} failed: {}'.format(url, e))
+        return None
+
+    async def _request(self, url):
+        #   only revalidate pages we still hold a parsed listing for
+        headers = {}
+        if url in self.listings:
+            etag, last_modified = self.validators.get(url, (None, None))
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        async with self.session.get(url, headers=headers) as r:
+            if r.status == 304 and headers:
+                return NOT_MODIFIED
+            if r.status != 200:
+                log.info('Page request to {} returned {}.'.format(url, r.status))
+                return None
+            page = await r.read()
+            self.validators[url] = (r.headers.get('ETag'),
+                                    r.headers.get('Last-Modified'))
+            return page
@@ -0,0 +1,19 @@
+"""Id lists kept as sets in memory and sorted lists on disk
+
+Used for the global blacklist/whitelist and the mod ignore lists, which
+user_allowed checks on every message.
+"""
+from .dataIO import dataIO
+
+
+# Kept as sets so user_allowed checks are constant time
+def load_id_sets(filename):
+    """Loads a json object of id lists as a dict of sets"""
+    data = dataIO.load_json(filename)
+    return {k: set(v) for k, v in data.items()}
+
+
+def save_id_sets(filename, id_sets):
+    """Saves a dict of id sets as sorted lists, so the file stays stable"""
+    data = {k: sorted(v) for k, v in id_sets.items()}
+    dataIO.save_json(filename, data)
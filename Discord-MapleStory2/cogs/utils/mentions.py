@@ -0,0 +1,67 @@
+"""Mention rate tracking for the mod cog"""
+from collections import OrderedDict
+import time
+
+
+class MentionRecord:
+    __slots__ = ("counts", "width", "epoch", "total", "expires")
+
+    def __init__(self, buckets, width, epoch):
+        self.counts = [0] * buckets
+        self.width = width
+        self.epoch = epoch
+        self.total = 0
+        self.expires = 0
+
+
+class MentionRateTracker:
+    """
+    Sliding window count of mentions per (server, author)
+
+    The window is split in a fixed number of buckets, so recording a
+    message only touches a handful of counters. Authors are forgotten
+    once their window has passed and at most `max_records` are held.
+    """
+    def __init__(self, buckets=10, max_records=100000):
+        self.buckets = buckets
+        self.max_records = max_records
+        self._records = OrderedDict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, server_id, author_id, mentions, seconds, now=None):
+        """Records mentions and returns the total within the last `seconds`"""
+        if now is None:
+            now = time.monotonic()
+        key = (server_id, author_id)
+        width = seconds / self.buckets
+        epoch = int(now // width)
+        record = self._records.get(key)
+        if (record is None or record.width != width or
+                epoch - record.epoch >= self.buckets):
+            record = self._records[key] = MentionRecord(self.buckets,
+                                                        width, epoch)
+        else:
+            # Clear the buckets that slid out of the window
+            counts = record.counts
+            for i in range(record.epoch + 1, epoch + 1):
+                slot = i % self.buckets
+                record.total -= counts[slot]
+                counts[slot] = 0
+            record.epoch = max(record.epoch, epoch)
+        record.counts[epoch % self.buckets] += mentions
+        record.total += mentions
+        record.expires = now + seconds
+        self._records.move_to_end(key)
+        self._evict(now)
+        return record.total
+
+    def _evict(self, now):
+        records = self._records
+        while records:
+            oldest = next(iter(records.values()))
+            if len(records) > self.max_records or oldest.expires < now:
+                records.popitem(last=False)
+            else:
+                break
@@ -0,0 +1,61 @@
+"""Balance ordering for the economy leaderboards"""
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+
+class BalanceIndex:
+    """
+    Accounts sorted by balance, per server and across every server
+
+    Bank updates it on each balance change so leaderboards and ranks
+    don't have to sort every account.
+    """
+
+    def __init__(self, accounts):
+        # server id -> sorted [(-balance, user id)]
+        self.servers = defaultdict(list)
+        # sorted [(-balance, user id, server id)]
+        self.everyone = []
+        for server_id, server_accounts in accounts.items():
+            if "balance" in server_accounts:  # Legacy account
+                continue
+            for user_id, account in server_accounts.items():
+                self.servers[server_id].append((-account["balance"], user_id))
+                self.everyone.append((-account["balance"], user_id,
+                                      server_id))
+        for entries in self.servers.values():
+            entries.sort()
+        self.everyone.sort()
+
+    def add(self, server_id, user_id, balance):
+        insort(self.servers[server_id], (-balance, user_id))
+        insort(self.everyone, (-balance, user_id, server_id))
+
+    def remove(self, server_id, user_id, balance):
+        _remove_sorted(self.servers[server_id], (-balance, user_id))
+        _remove_sorted(self.everyone, (-balance, user_id, server_id))
+
+    def clear(self, server_id):
+        if self.servers.pop(server_id, None):
+            self.everyone = [e for e in self.everyone if e[2] != server_id]
+
+    def top(self, server_id=None):
+        """Yields (balance, user id, server id) from the richest down"""
+        if server_id is None:
+            for balance, user_id, server_id in self.everyone:
+                yield -balance, user_id, server_id
+        else:
+            for balance, user_id in self.servers.get(server_id, []):
+                yield -balance, user_id, server_id
+
+    def ahead(self, server_id, user_id, balance):
+        """Yields the ids ranked above user_id on the server"""
+        entries = self.servers.get(server_id, [])
+        for i in range(bisect_left(entries, (-balance, user_id))):
+            yield entries[i][1]
+
+
+def _remove_sorted(entries, entry):
+    i = bisect_left(entries, entry)
+    if i < len(entries) and entries[i] == entry:
+        del entries[i]
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+log = logging.getLogger("red.ratelimit")
+
+
+class TokenBucket:
+    """Hands out `rate` tokens per second, up to `capacity` at once"""
+
+    def __init__(self, rate, capacity, loop):
+        self.rate = rate
+        self.capacity = capacity
+        self.loop = loop
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    @property
+    def idle(self):
+        self._refill()
+        return (self.tokens >= self.capacity and
+                self.blocked_until <= self.updated)
+
+    async def acquire(self):
+        while True:
+            now = self._refill()
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+            elif self.tokens >= 1:
+                self.tokens -= 1
+                return
+            else:
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay, loop=self.loop)
+
+    def penalize(self, retry_after):
+        """Empties the bucket and holds it for retry_after seconds"""
+        self._refill()
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until,
+                                 time.monotonic() + retry_after)
+
+
+class DeletionScheduler:
+    """
+    Paces message deletions to Discord's rate limits
+
+    Single and bulk deletions get their own bucket per channel and every
+    request also draws from a global bucket. A 429 empties the bucket
+    that hit it for the time Discord asks, then the request is retried.
+    """
+
+    MAX_RETRIES = 3
+    MAX_IDLE_BUCKETS = 1000
+
+    def __init__(self, bot, *, single_rate=5, bulk_rate=1, global_rate=50):
+        self.bot = bot
+        self.single_rate = single_rate
+        self.bulk_rate = bulk_rate
+        self.global_bucket = TokenBucket(global_rate, global_rate, bot.loop)
+        self._buckets = {}
+
+    def _bucket(self, channel, bulk):
+        key = (channel.id, bulk)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_IDLE_BUCKETS:
+                self._prune()
+            rate = self.bulk_rate if bulk else self.single_rate
+            bucket = self._buckets[key] = TokenBucket(rate, rate,
+                                                      self.bot.loop)
+        return bucket
+
+    def _prune(self):
+        # A full bucket behaves exactly like a new one
+        for key in [k for k, b in self._buckets.items() if b.idle]:
+            del self._buckets[key]
+
+    async def _request(self, bucket, coro_factory):
+        for attempt in range(self.MAX_RETRIES + 1):
+            await self.global_bucket.acquire()
+            await bucket.acquire()
+            try:
+                return await coro_factory()
+            except discord.HTTPException as e:
+                if e.response.status != 429 or attempt == self.MAX_RETRIES:
+                    raise
+                retry_after = _retry_after(e)
+                log.debug("Deletion rate limited, retrying in {}s"
+                          "".format(retry_after))
+                bucket.penalize(retry_after)
+
+    async def delete(self, message):
+        """Deletes a single message, raising like Client.delete_message"""
+        bucket = self._bucket(message.channel, False)
+        await self._request(bucket,
+                            lambda: self.bot.delete_message(message))
+
+    async def delete_many(self, messages):
+        """Deletes messages of one channel, 100 per bulk request
+
+        All messages must be younger than 14 days."""
+        messages = list(messages)
+        for i in range(0, len(messages), 100):
+            chunk = messages[i:i + 100]
+            if len(chunk) == 1:
+                await self.delete(chunk[0])
+                continue
+            bucket = self._bucket(chunk[0].channel, True)
+            await self._request(bucket,
+                                lambda: self.bot.delete_messages(chunk))
+
+
+async def gather_with_backoff(factories, *, limit, loop, retries=3):
+    """Runs coroutine factories with at most `limit` in flight
+
+    Requests that hit a 429 wait as long as Discord asks and are
+    retried. Returns results and exceptions in the factories' order."""
+    semaphore = asyncio.Semaphore(limit, loop=loop)
+
+    async def run(factory):
+        with await semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    return await factory()
+                except discord.HTTPException as e:
+                    if e.response.status != 429 or attempt == retries:
+                        raise
+                    await asyncio.sleep(_retry_after(e), loop=loop)
+
+    return await asyncio.gather(*(run(f) for f in factories), loop=loop,
+                                return_exceptions=True)
+
+
+def _retry_after(error):
+    # Discord's Retry-After header is in milliseconds
+    try:
+        return float(error.response.headers["Retry-After"]) / 1000
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 1
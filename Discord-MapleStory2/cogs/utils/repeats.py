@@ -0,0 +1,59 @@
+"""Repeated message tracking for the mod cog"""
+from collections import OrderedDict
+import time
+
+
+class RepeatRecord:
+    __slots__ = ("fingerprint", "count", "last_seen")
+
+    def __init__(self, fingerprint, last_seen):
+        self.fingerprint = fingerprint
+        self.count = 1
+        self.last_seen = last_seen
+
+
+class RepeatTracker:
+    """
+    Counts consecutive identical messages per (server, author)
+
+    Only a hash of the last message is kept, so a record costs the same
+    whatever the message size. Records expire after `window` seconds
+    of silence and at most `max_records` are held, oldest evicted first.
+    """
+    def __init__(self, window=300, max_records=100000):
+        self.window = window
+        self.max_records = max_records
+        self._records = OrderedDict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, server_id, author_id, content, now=None):
+        """Records a message and returns how many times in a row it was sent"""
+        if now is None:
+            now = time.monotonic()
+        key = (server_id, author_id)
+        fingerprint = hash(content)
+        record = self._records.get(key)
+        if record is None or now - record.last_seen > self.window:
+            record = self._records[key] = RepeatRecord(fingerprint, now)
+        elif record.fingerprint == fingerprint:
+            record.count += 1
+            record.last_seen = now
+        else:
+            record.fingerprint = fingerprint
+            record.count = 1
+            record.last_seen = now
+        self._records.move_to_end(key)
+        self._evict(now)
+        return record.count
+
+    def _evict(self, now):
+        records = self._records
+        while records:
+            oldest = next(iter(records.values()))
+            if (len(records) > self.max_records or
+                    now - oldest.last_seen > self.window):
+                records.popitem(last=False)
+            else:
+                break
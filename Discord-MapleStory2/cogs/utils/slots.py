@@ -0,0 +1,141 @@
+"""Slot machine reels, payouts and a vectorized simulator"""
+from collections import deque, namedtuple
+from enum import Enum
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUM_ENC = "\N{COMBINING ENCLOSING KEYCAP}"
+
+
+class SMReel(Enum):
+    cherries  = "\N{CHERRIES}"
+    cookie    = "\N{COOKIE}"
+    two       = "\N{DIGIT TWO}" + NUM_ENC
+    flc       = "\N{FOUR LEAF CLOVER}"
+    cyclone   = "\N{CYCLONE}"
+    sunflower = "\N{SUNFLOWER}"
+    six       = "\N{DIGIT SIX}" + NUM_ENC
+    mushroom  = "\N{MUSHROOM}"
+    heart     = "\N{HEAVY BLACK HEART}"
+    snowflake = "\N{SNOWFLAKE}"
+
+PAYOUTS = {
+    (SMReel.two, SMReel.two, SMReel.six) : {
+        "payout" : lambda x: x * 2500 + x,
+        "phrase" : "JACKPOT! 226! Your bid has been multiplied * 2500!"
+    },
+    (SMReel.flc, SMReel.flc, SMReel.flc) : {
+        "payout" : lambda x: x + 1000,
+        "phrase" : "4LC! +1000!"
+    },
+    (SMReel.cherries, SMReel.cherries, SMReel.cherries) : {
+        "payout" : lambda x: x + 800,
+        "phrase" : "Three cherries! +800!"
+    },
+    (SMReel.two, SMReel.six) : {
+        "payout" : lambda x: x * 4 + x,
+        "phrase" : "2 6! Your bid has been multiplied * 4!"
+    },
+    (SMReel.cherries, SMReel.cherries) : {
+        "payout" : lambda x: x * 3 + x,
+        "phrase" : "Two cherries! Your bid has been multiplied * 3!"
+    },
+    "3 symbols" : {
+        "payout" : lambda x: x + 500,
+        "phrase" : "Three symbols! +500!"
+    },
+    "2 symbols" : {
+        "payout" : lambda x: x * 2 + x,
+        "phrase" : "Two consecutive symbols! Your bid has been multiplied * 2!"
+    },
+}
+
+# Each reel is rotated by up to this many symbols either way
+MAX_ROTATION = 999
+
+SlotStats = namedtuple("SlotStats", "bid spins rtp hit_frequency variance")
+
+
+def spin_reels():
+    """Returns the three rows shown by a spin, the middle one pays"""
+    default_reel = deque(SMReel)
+    reels = []
+    for i in range(3):
+        default_reel.rotate(random.randint(-MAX_ROTATION, MAX_ROTATION))
+        new_reel = deque(default_reel, maxlen=3) # we need only 3 symbols
+        reels.append(new_reel)                   # for each reel
+    return ((reels[0][0], reels[1][0], reels[2][0]),
+            (reels[0][1], reels[1][1], reels[2][1]),
+            (reels[0][2], reels[1][2], reels[2][2]))
+
+
+def find_payout(line):
+    """Returns the PAYOUTS entry the line wins, or None"""
+    payout = PAYOUTS.get(line)
+    if not payout:
+        # Checks for two-consecutive-symbols special rewards
+        payout = PAYOUTS.get((line[0], line[1]),
+                             PAYOUTS.get((line[1], line[2])))
+    if not payout:
+        # Still nothing. Let's check for 3 generic same symbols
+        # or 2 consecutive symbols
+        has_three = line[0] == line[1] == line[2]
+        has_two = (line[0] == line[1]) or (line[1] == line[2])
+        if has_three:
+            payout = PAYOUTS["3 symbols"]
+        elif has_two:
+            payout = PAYOUTS["2 symbols"]
+    return payout
+
+
+def payout_table(bid):
+    """Credits paid for every possible line at bid, indexed by the
+    line's symbol positions in SMReel as a base len(SMReel) number"""
+    symbols = list(SMReel)
+    table = np.zeros(len(symbols) ** 3, dtype=np.int64)
+    i = 0
+    for a in symbols:
+        for b in symbols:
+            for c in symbols:
+                payout = find_payout((a, b, c))
+                if payout:
+                    table[i] = payout["payout"](bid)
+                i += 1
+    return table
+
+
+def simulate(bid, spins, *, seed=None, chunk_size=1000000):
+    """Plays spins spins at bid and returns their SlotStats
+
+    The variance is the one of a spin's net result in credits."""
+    if np is None:
+        raise RuntimeError("The slot simulator needs numpy. "
+                           "Install it with: pip3 install numpy")
+    n = len(SMReel)
+    table = payout_table(bid)
+    rng = np.random.RandomState(seed)
+    paid = hits = 0
+    net_squares = 0.0
+    done = 0
+    while done < spins:
+        size = min(chunk_size, spins - done)
+        rotations = rng.randint(-MAX_ROTATION, MAX_ROTATION + 1,
+                                size=(size, 3))
+        # The reels share one deque, so their rotations add up. A reel
+        # keeps the last 3 of its symbols, the middle line shows the
+        # one second to last.
+        offsets = np.cumsum(rotations, axis=1)
+        lines = (n - 2 - offsets) % n
+        pays = table[(lines[:, 0] * n + lines[:, 1]) * n + lines[:, 2]]
+        paid += int(pays.sum())
+        hits += int(np.count_nonzero(pays))
+        net_squares += float(np.square(pays - bid, dtype=np.float64).sum())
+        done += size
+    mean_net = paid / spins - bid
+    return SlotStats(bid=bid, spins=spins, rtp=paid / (bid * spins),
+                     hit_frequency=hits / spins,
+                     variance=net_squares / spins - mean_net ** 2)
@@ -0,0 +1,39 @@
+"""Word filter matching for the mod cog"""
+import re
+
+
+def build_filter_pattern(words):
+    """Compiles filtered words into a single trie-shaped regex
+
+    Shared prefixes are matched once, so a search costs about one pass
+    over the message no matter how many words are filtered."""
+    if not words:
+        return None
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return re.compile(_trie_to_regex(trie))
+
+
+def _trie_to_regex(node):
+    branches = []
+    for char in sorted(k for k in node if k):
+        child = node[char]
+        prefix = re.escape(char)
+        # Single child chains are emitted as plain literals
+        while len(child) == 1 and "" not in child:
+            (char, child), = child.items()
+            prefix += re.escape(char)
+        branches.append(prefix + _trie_to_regex(child))
+
+    if not branches:
+        return ""
+    if len(branches) == 1 and "" not in node:
+        return branches[0]
+    regex = "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        regex += "?"
+    return regex
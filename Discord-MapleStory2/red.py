@@ -21,6 +21,7 @@ except ImportError:
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import inline
+from cogs.utils.ratelimit import DeletionScheduler
 from collections import Counter
 from io import TextIOWrapper
 
@@ -63,6 +64,7 @@ class Bot(commands.Bot):
         self.logger = set_logger(self)
         self._last_exception = None
         self.oauth_url = ""
+        self._role_cache = {}
         if 'self_bot' in kwargs:
             self.settings.self_bot = kwargs['self_bot']
         else:
@@ -70,6 +72,7 @@ class Bot(commands.Bot):
             if self.settings.self_bot:
                 kwargs['pm_help'] = False
         super().__init__(*args, command_prefix=prefix_manager, **kwargs)
+        self.deletion_scheduler = DeletionScheduler(self)
 
     async def send_message(self, *args, **kwargs):
         if self._message_modifiers:
@@ -140,6 +143,35 @@ class Bot(commands.Bot):
             for page in pages:
                 await self.send_message(ctx.message.channel, page)
 
+    def is_admin_or_mod(self, member):
+        """
+        Returns a (is_admin, is_mod) tuple for a member based on the
+        server's admin and mod role names.
+
+        Results are cached per server and member. Entries are dropped
+        on role, member and server changes and are ignored once the
+        configured role names differ from the ones they were built with.
+        """
+        server = member.server
+        admin_role = self.settings.get_server_admin(server)
+        mod_role = self.settings.get_server_mod(server)
+        key = (server.id, member.id)
+        cached = self._role_cache.get(key)
+        if cached is not None and cached[:2] == (admin_role, mod_role):
+            return cached[2:]
+        names = {r.name for r in member.roles}
+        cached = (admin_role, mod_role, admin_role in names, mod_role in names)
+        self._role_cache[key] = cached
+        return cached[2:]
+
+    def invalidate_role_cache(self, server, member=None):
+        """Drops cached role lookups for a member or a whole server"""
+        if member is not None:
+            self._role_cache.pop((server.id, member.id), None)
+            return
+        for key in [k for k in self._role_cache if k[0] == server.id]:
+            del self._role_cache[key]
+
     def user_allowed(self, message):
         author = message.author
 
@@ -163,15 +195,8 @@ class Bot(commands.Bot):
                 return False
 
         if not message.channel.is_private:
-            server = message.server
-            names = (self.settings.get_server_admin(
-                server), self.settings.get_server_mod(server))
-            results = map(
-                lambda name: discord.utils.get(author.roles, name=name),
-                names)
-            for r in results:
-                if r is not None:
-                    return True
+            if any(self.is_admin_or_mod(author)):
+                return True
 
         if mod_cog is not None:
             if not message.channel.is_private:
@@ -335,6 +360,28 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     async def on_resumed():
         bot.counter["session_resumed"] += 1
 
+    @bot.event
+    async def on_member_update(before, after):
+        if before.roles != after.roles:
+            bot.invalidate_role_cache(after.server, after)
+
+    @bot.event
+    async def on_member_remove(member):
+        bot.invalidate_role_cache(member.server, member)
+
+    @bot.event
+    async def on_server_role_update(before, after):
+        if before.name != after.name:
+            bot.invalidate_role_cache(after.server)
+
+    @bot.event
+    async def on_server_role_delete(role):
+        bot.invalidate_role_cache(role.server)
+
+    @bot.event
+    async def on_server_remove(server):
+        bot.invalidate_role_cache(server)
+
     @bot.event
     async def on_command(command, ctx):
         bot.counter["processed_commands"] += 1
@@ -634,6 +681,9 @@ if __name__ == '__main__':
                              exc_info=e)
         loop.run_until_complete(bot.logout())
     finally:
+        # Unloading lets cogs flush writes they were holding back
+        for cog in list(bot.cogs):
+            bot.remove_cog(cog)
         loop.close()
         if bot._shutdown_mode is True:
             exit(0)